@@ -112,5 +112,6 @@ shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}')
 #
 # Write files
 #
-out.output(OutputDriver_Print())
-# out.output(OutputDriver_Directory('/tmp/build-gke'))
+if __name__ == '__main__':
+    out.output(OutputDriver_Print())
+    # out.output(OutputDriver_Directory('/tmp/build-gke'))
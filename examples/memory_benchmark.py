@@ -0,0 +1,52 @@
+"""
+Measures the memory used by each generated Loki Stack, keeping the builder and its built objects alive,
+as a service generating many stacks would.
+
+Usage: python memory_benchmark.py [number of stacks]
+"""
+import gc
+import sys
+import tracemalloc
+
+from kubragen import KubraGen
+from kubragen.provider import Provider_Generic
+
+from kg_lokistack import LokiStackBuilder, LokiStackOptions
+
+kg = KubraGen(provider=Provider_Generic())
+
+
+def create_stack(index: int):
+    lokistack_config = LokiStackBuilder(kubragen=kg, options=LokiStackOptions({
+        'namespace': 'monitoring',
+        'basename': 'stack{}'.format(index),
+        'kubernetes': {
+            'volumes': {
+                'loki-data': {
+                    'emptyDir': {},
+                }
+            }
+        }
+    }))
+    return lokistack_config, lokistack_config.build(*lokistack_config.build_names())
+
+
+def main(count: int):
+    # warm up module level caches, so they are not counted as per stack memory
+    create_stack(-1)
+    gc.collect()
+
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    stacks = [create_stack(i) for i in range(count)]
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('stacks: {}'.format(len(stacks)))
+    print('retained bytes per stack: {:.0f}'.format((current - start) / count))
+    print('peak bytes per stack: {:.0f}'.format((peak - start) / count))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -4,9 +4,45 @@ from .builder import (
 from .option import (
     LokiStackOptions
 )
+from .configfileext import (
+    GrafanaConfigFileExt_DataProxy,
+    LokiConfigFileExt_Memberlist,
+    LokiConfigFileExt_Ruler,
+    LokiConfigFileExt_S3,
+    PromtailConfigFileExt_NodeScoped,
+)
+from .advisor import (
+    advise,
+    LokiStackAdvice,
+    LokiStackAdviceLevel,
+)
+from .loadtest import (
+    LokiStackMetricsSample,
+    LokiStackLoadTestResult,
+    loadtest_metrics_parse,
+    loadtest_sample,
+    loadtest_result,
+)
+from .asyncbuild import (
+    LokiStackAsyncBuilder,
+)
 __version__ = "0.8.3"
 
 __all__ = [
     'LokiStackOptions',
     'LokiStackBuilder',
+    'GrafanaConfigFileExt_DataProxy',
+    'LokiConfigFileExt_Memberlist',
+    'LokiConfigFileExt_Ruler',
+    'LokiConfigFileExt_S3',
+    'PromtailConfigFileExt_NodeScoped',
+    'advise',
+    'LokiStackAdvice',
+    'LokiStackAdviceLevel',
+    'LokiStackMetricsSample',
+    'LokiStackLoadTestResult',
+    'loadtest_metrics_parse',
+    'loadtest_sample',
+    'loadtest_result',
+    'LokiStackAsyncBuilder',
 ]
\ No newline at end of file
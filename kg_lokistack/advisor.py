@@ -0,0 +1,186 @@
+from enum import IntEnum
+from typing import List, Any, Optional, Mapping
+
+import yaml
+
+from kubragen.kdata import KData_Value
+
+from .builder import LokiStackBuilder
+
+
+class LokiStackAdviceLevel(IntEnum):
+    """
+    Severity of a :class:`LokiStackAdvice`. Higher values are more severe.
+    """
+
+    INFO = 1
+    """Possible improvement"""
+
+    WARNING = 2
+    """Likely to limit throughput or stability under load"""
+
+    CRITICAL = 3
+    """Will limit throughput or lose data under load"""
+
+
+class LokiStackAdvice:
+    """
+    A performance advice about a configured Loki Stack.
+
+    :param level: the advice severity
+    :param option: the option path to change, in dot format
+    :param message: the advice description
+    """
+    level: LokiStackAdviceLevel
+    option: str
+    message: str
+
+    def __init__(self, level: LokiStackAdviceLevel, option: str, message: str):
+        self.level = level
+        self.option = option
+        self.message = message
+
+    def __str__(self):
+        return '[{}] {}: {}'.format(self.level.name, self.option, self.message)
+
+    def __repr__(self):
+        return 'LokiStackAdvice({}, {!r}, {!r})'.format(self.level.name, self.option, self.message)
+
+
+PROMTAIL_MIN_BATCHSIZE = 262144
+"""Promtail client batch size (bytes) below which pushes are considered too small."""
+
+
+def advise(builder: LokiStackBuilder, min_level: LokiStackAdviceLevel = LokiStackAdviceLevel.INFO) \
+        -> List[LokiStackAdvice]:
+    """
+    Inspects the builder options and its rendered Loki and Promtail configurations, and reports
+    performance pitfalls.
+
+    :param builder: the Loki Stack builder to inspect
+    :param min_level: the minimum advice level to report
+    :return: the list of advices, most severe first
+    """
+    ret: List[LokiStackAdvice] = []
+    ret.extend(_advise_resources(builder))
+    ret.extend(_advise_volumes(builder))
+    ret.extend(_advise_loki_config(builder))
+    ret.extend(_advise_promtail_config(builder))
+    ret = [a for a in ret if a.level >= min_level]
+    ret.sort(key=lambda a: a.level, reverse=True)
+    return ret
+
+
+def _advise_resources(builder: LokiStackBuilder) -> List[LokiStackAdvice]:
+    ret: List[LokiStackAdvice] = []
+    if not _has_resources(builder.option_get('kubernetes.resources.loki-statefulset')):
+        ret.append(LokiStackAdvice(
+            LokiStackAdviceLevel.WARNING, 'kubernetes.resources.loki-statefulset',
+            'Loki has no resource requests/limits, it can be starved of CPU or OOM-killed under ingestion load'))
+    if not _has_resources(builder.option_get('kubernetes.resources.promtail-daemonset')):
+        ret.append(LokiStackAdvice(
+            LokiStackAdviceLevel.INFO, 'kubernetes.resources.promtail-daemonset',
+            'Promtail has no resource requests/limits'))
+    if builder.option_get('enable.grafana') is not False and \
+            not _has_resources(builder.option_get('kubernetes.resources.grafana-deployment')):
+        ret.append(LokiStackAdvice(
+            LokiStackAdviceLevel.INFO, 'kubernetes.resources.grafana-deployment',
+            'Grafana has no resource requests/limits'))
+    return ret
+
+
+def _advise_volumes(builder: LokiStackBuilder) -> List[LokiStackAdvice]:
+    ret: List[LokiStackAdvice] = []
+    if _is_emptydir(builder.option_get('kubernetes.volumes.loki-data')):
+        if builder.option_get('config.loki.storage.type') == 's3':
+            ret.append(LokiStackAdvice(
+                LokiStackAdviceLevel.INFO, 'kubernetes.volumes.loki-data',
+                'Loki data is on an emptyDir, chunks and index are on S3 but the index files not yet uploaded '
+                'and the local caches are lost on every pod restart'))
+        else:
+            ret.append(LokiStackAdvice(
+                LokiStackAdviceLevel.CRITICAL, 'kubernetes.volumes.loki-data',
+                'Loki data is on an emptyDir, index and chunks are lost on every pod restart and compete with the '
+                'node root disk'))
+    if builder.option_get('enable.grafana') is not False and \
+            _is_emptydir(builder.option_get('kubernetes.volumes.grafana-data')):
+        ret.append(LokiStackAdvice(
+            LokiStackAdviceLevel.WARNING, 'kubernetes.volumes.grafana-data',
+            'Grafana data is on an emptyDir, its database and caches are rebuilt on every pod restart'))
+    return ret
+
+
+def _advise_loki_config(builder: LokiStackBuilder) -> List[LokiStackAdvice]:
+    ret: List[LokiStackAdvice] = []
+    config = _parse_config(builder.loki_configfile_get())
+    if config is None:
+        return [LokiStackAdvice(LokiStackAdviceLevel.INFO, 'config.loki.loki_config',
+                                'Loki config could not be parsed, config checks skipped')]
+
+    query_range = config.get('query_range') or {}
+    if query_range.get('cache_results') is not True:
+        ret.append(LokiStackAdvice(
+            LokiStackAdviceLevel.WARNING, 'config.loki.loki_config',
+            'Loki query results cache is disabled (query_range.cache_results is not true{}), repeated dashboard '
+            'queries are recomputed every time'.format(
+                '' if 'results_cache' in query_range else ' and query_range.results_cache is not configured')))
+
+    chunk_store_config = config.get('chunk_store_config') or {}
+    if 'chunk_cache_config' not in chunk_store_config:
+        ret.append(LokiStackAdvice(
+            LokiStackAdviceLevel.INFO, 'config.loki.loki_config',
+            'Loki chunk cache is not configured (chunk_store_config.chunk_cache_config), chunks are re-read '
+            'from storage for every query'))
+
+    ingester = config.get('ingester') or {}
+    if 'chunk_target_size' not in ingester:
+        ret.append(LokiStackAdvice(
+            LokiStackAdviceLevel.INFO, 'config.loki.loki_config',
+            'Loki ingester chunk_target_size is not set, low volume streams flush many small chunks'))
+    return ret
+
+
+def _advise_promtail_config(builder: LokiStackBuilder) -> List[LokiStackAdvice]:
+    ret: List[LokiStackAdvice] = []
+    config = _parse_config(builder.promtail_configfile_get())
+    if config is None:
+        return [LokiStackAdvice(LokiStackAdviceLevel.INFO, 'config.promtail.promtail_config',
+                                'Promtail config could not be parsed, config checks skipped')]
+
+    if builder.option_get('config.promtail.node_scoped_discovery') is False:
+        ret.append(LokiStackAdvice(
+            LokiStackAdviceLevel.INFO, 'config.promtail.node_scoped_discovery',
+            'Each Promtail watches all pods of the cluster, on large clusters this loads the API server and '
+            'Promtail memory'))
+
+    clients = list(config.get('clients') or [])
+    if config.get('client') is not None:
+        clients.append(config.get('client'))
+    for client in clients:
+        batchsize = client.get('batchsize')
+        if batchsize is not None and batchsize < PROMTAIL_MIN_BATCHSIZE:
+            ret.append(LokiStackAdvice(
+                LokiStackAdviceLevel.WARNING, 'config.promtail.promtail_config',
+                'Promtail client batchsize is {} bytes, small batches multiply push requests to Loki '
+                '(recommended at least {})'.format(batchsize, PROMTAIL_MIN_BATCHSIZE)))
+    return ret
+
+
+def _has_resources(value: Any) -> bool:
+    return isinstance(value, Mapping) and (bool(value.get('requests')) or bool(value.get('limits')))
+
+
+def _is_emptydir(value: Any) -> bool:
+    if isinstance(value, KData_Value):
+        value = value.value
+    return isinstance(value, Mapping) and 'emptyDir' in value
+
+
+def _parse_config(value: str) -> Optional[Mapping]:
+    try:
+        ret = yaml.safe_load(value)
+    except yaml.YAMLError:
+        return None
+    if not isinstance(ret, Mapping):
+        return None
+    return ret
@@ -0,0 +1,90 @@
+import asyncio
+import functools
+from concurrent.futures import Executor
+from typing import Optional, Sequence, Callable, Any, TypeVar
+
+from kubragen import KubraGen
+from kubragen.exception import InvalidParamError
+from kubragen.object import ObjectItem
+from kubragen.output import OutputProject, OutputDriver, OutputFile_Kubernetes, OutputDataDumper
+from kubragen.types import TBuild
+
+from .builder import LokiStackBuilder
+from .option import LokiStackOptions
+
+T = TypeVar('T')
+
+
+class LokiStackAsyncBuilder:
+    """
+    Runs :class:`LokiStackBuilder` creation, builds and outputs from asyncio code without blocking the event loop.
+
+    The work is offloaded to an executor, and at most *max_concurrency* jobs run at the same time, the others
+    wait without holding an executor worker.
+
+    :param max_concurrency: maximum number of jobs running concurrently
+    :param executor: the executor to run the jobs on. If None, the event loop default executor is used.
+        As rendering is CPU-bound, a :class:`concurrent.futures.ProcessPoolExecutor` can be used if the
+        builder options can be pickled.
+    """
+    max_concurrency: int
+    executor: Optional[Executor]
+    _semaphore: Optional[asyncio.Semaphore]
+
+    def __init__(self, max_concurrency: int = 4, executor: Optional[Executor] = None):
+        if max_concurrency < 1:
+            raise InvalidParamError('max_concurrency must be at least 1')
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self._semaphore = None
+
+    async def create(self, kubragen: KubraGen, options: Optional[LokiStackOptions] = None) -> LokiStackBuilder:
+        """
+        Creates a :class:`LokiStackBuilder`.
+
+        :param kubragen: the :class:`kubragen.kubragen.KubraGen` instance
+        :param options: the builder options
+        :return: the builder
+        """
+        return await self._run(LokiStackBuilder, kubragen, options)
+
+    async def build(self, builder: LokiStackBuilder, *buildnames: TBuild) -> Sequence[ObjectItem]:
+        """
+        Builds the result, see :func:`kubragen.builder.Builder.build`.
+
+        :param builder: the builder
+        :param buildnames: list of build names
+        :return: list of :class:`kubragen.object.ObjectItem`
+        """
+        return await self._run(builder.build, *buildnames)
+
+    async def build_yaml(self, builder: LokiStackBuilder, *buildnames: TBuild) -> str:
+        """
+        Builds the result and outputs it as a Kubernetes YAML string.
+
+        :param builder: the builder
+        :param buildnames: list of build names
+        :return: the Kubernetes YAML
+        """
+        return await self._run(_build_yaml, builder, *buildnames)
+
+    async def output(self, project: OutputProject, driver: OutputDriver) -> None:
+        """
+        Outputs all the files of the project to the driver, see :func:`kubragen.output.OutputProject.output`.
+
+        :param project: the project to output
+        :param driver: driver to output to
+        """
+        await self._run(project.output, driver)
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+
+def _build_yaml(builder: LokiStackBuilder, *buildnames: TBuild) -> str:
+    file = OutputFile_Kubernetes('lokistack.yaml')
+    file.append(builder.build(*buildnames))
+    return file.to_string(OutputDataDumper(builder.kubragen))
@@ -1,16 +1,28 @@
 import copy
-from typing import Optional, Sequence, Mapping, List
+import datetime
+import posixpath
+import re
+from typing import Optional, Sequence, Mapping, List, Any, Dict, Tuple
 
-from kg_grafana import GrafanaBuilder, GrafanaOptions
-from kg_loki import LokiBuilder, LokiOptions
+from kg_grafana import GrafanaBuilder, GrafanaOptions, GrafanaConfigFile
+from kg_loki import LokiBuilder, LokiOptions, LokiConfigFile
 from kg_promtail import PromtailBuilder, PromtailOptions, PromtailConfigFile, PromtailConfigFileExt_Kubernetes
 from kubragen import KubraGen
 from kubragen.builder import Builder
+from kubragen.configfile import ConfigFileExtension, ConfigFile_Extend, ConfigFileRender_Yaml, ConfigFileOutput_Dict
 from kubragen.exception import InvalidParamError, InvalidNameError, OptionError
+from kubragen.data import ValueData
+from kubragen.helper import LiteralStr
+from kubragen.jsonpatch import FilterJSONPatch, ObjectFilter
+from kubragen.kdata import KData_Value
+from kubragen.kdatahelper import KDataHelper_Env, KDataHelper_Volume
 from kubragen.object import ObjectItem, Object
 from kubragen.types import TBuild, TBuildItem
 
+from .configfileext import GrafanaConfigFileExt_DataProxy, LokiConfigFileExt_Memberlist, LokiConfigFileExt_Ruler, \
+    LokiConfigFileExt_S3, PromtailConfigFileExt_NodeScoped
 from .option import LokiStackOptions
+from .share import share_immutable
 
 
 class LokiStackBuilder(Builder):
@@ -30,6 +42,8 @@ class LokiStackBuilder(Builder):
           - creates ConfigMap and Secret
         * - BUILD_SERVICE
           - creates deployments and services
+        * - BUILD_LOADTEST
+          - creates the load test log generator Deployment and query Job (only if *enable.loadtest* is True)
 
     .. list-table::
         :header-rows: 1
@@ -48,6 +62,8 @@ class LokiStackBuilder(Builder):
           - Promtail Daemonset
         * - BUILDITEM_CONFIG_LOKI_SECRET
           - Loki Secret
+        * - BUILDITEM_LOKI_RULES_CONFIG
+          - Loki ruler rules ConfigMap
         * - BUILDITEM_LOKI_SERVICE_HEADLESS
           - Loki Service Headless
         * - BUILDITEM_LOKI_SERVICE
@@ -58,6 +74,14 @@ class LokiStackBuilder(Builder):
           - Grafana Deployment
         * - BUILDITEM_GRAFANA_SERVICE
           - Grafana Service
+        * - BUILDITEM_MINIO_SERVICE
+          - MinIO Service
+        * - BUILDITEM_MINIO_STATEFULSET
+          - MinIO StatefulSet
+        * - BUILDITEM_LOADTEST_GENERATOR
+          - Load test log generator Deployment
+        * - BUILDITEM_LOADTEST_QUERY
+          - Load test query Job
 
     .. list-table::
         :header-rows: 1
@@ -86,6 +110,9 @@ class LokiStackBuilder(Builder):
         * - loki-config-secret
           - Loki Secret
           - ```<basename>-loki-config-secret```
+        * - loki-rules-config
+          - Loki ruler rules ConfigMap
+          - ```<basename>-loki-rules```
         * - loki-service-headless
           - Loki Service headless
           - ```<basename>-loki-headless```
@@ -104,6 +131,24 @@ class LokiStackBuilder(Builder):
         * - grafana-deployment
           - Grafana Deployment
           - ```<basename>-grafana```
+        * - minio-service
+          - MinIO Service
+          - ```<basename>-minio```
+        * - minio-statefulset
+          - MinIO StatefulSet
+          - ```<basename>-minio```
+        * - minio-pod-label-app
+          - MinIO label *app* to be used by selection
+          - ```<basename>-minio```
+        * - loadtest-generator
+          - Load test log generator Deployment
+          - ```<basename>-loadtest-generator```
+        * - loadtest-generator-pod-label-app
+          - Load test log generator label *app* to be used by selection
+          - ```<basename>-loadtest-generator```
+        * - loadtest-query
+          - Load test query Job
+          - ```<basename>-loadtest-query```
     """
     options: LokiStackOptions
     _namespace: str
@@ -111,9 +156,14 @@ class LokiStackBuilder(Builder):
 
     SOURCE_NAME = 'kg_lokistack'
 
+    PROMTAIL_NODE_NAME_PLACEHOLDER = '__KG_NODE_NAME__'
+    LOKI_RULES_PATH = '/etc/loki-rules'
+    GRAFANA_LOKI_DATASOURCE_TIMEOUT = 60
+
     BUILD_ACCESSCONTROL = TBuild('accesscontrol')
     BUILD_CONFIG = TBuild('config')
     BUILD_SERVICE = TBuild('service')
+    BUILD_LOADTEST = TBuild('loadtest')
 
     BUILDITEM_SERVICE_ACCOUNT = TBuildItem('service-account')
     BUILDITEM_PROMTAIL_CONFIG = TBuildItem('promtail-config')
@@ -121,11 +171,16 @@ class LokiStackBuilder(Builder):
     BUILDITEM_PROMTAIL_CLUSTER_ROLE_BINDING = TBuildItem('promtail-cluster-role-binding')
     BUILDITEM_PROMTAIL_DAEMONSET = TBuildItem('promtail-daemonset')
     BUILDITEM_LOKI_CONFIG_SECRET = TBuildItem('loki-config-secret')
+    BUILDITEM_LOKI_RULES_CONFIG = TBuildItem('loki-rules-config')
     BUILDITEM_LOKI_SERVICE_HEADLESS = TBuildItem('loki-service-headless')
     BUILDITEM_LOKI_SERVICE = TBuildItem('loki-service')
     BUILDITEM_LOKI_STATEFULSET = TBuildItem('loki-statefulset')
     BUILDITEM_GRAFANA_DEPLOYMENT = TBuildItem('grafana-deployment')
     BUILDITEM_GRAFANA_SERVICE = TBuildItem('grafana-service')
+    BUILDITEM_MINIO_SERVICE = TBuildItem('minio-service')
+    BUILDITEM_MINIO_STATEFULSET = TBuildItem('minio-statefulset')
+    BUILDITEM_LOADTEST_GENERATOR = TBuildItem('loadtest-generator')
+    BUILDITEM_LOADTEST_QUERY = TBuildItem('loadtest-query')
 
     def __init__(self, kubragen: KubraGen, options: Optional[LokiStackOptions] = None):
         super().__init__(kubragen)
@@ -136,6 +191,54 @@ class LokiStackBuilder(Builder):
 
         self._namespace = self.option_get('namespace')
 
+        if self.option_get('config.loki.replicas') < 1:
+            raise InvalidParamError('Loki replicas must be at least 1')
+        if self.option_get('config.loki.replication_factor') is not None and \
+                not (1 <= self.option_get('config.loki.replication_factor') <= self.option_get('config.loki.replicas')):
+            raise InvalidParamError('Loki replication factor must be between 1 and the number of replicas')
+        if self.option_get('config.loadtest.streams') < 1:
+            raise InvalidParamError('Load test streams must be at least 1')
+        if self.option_get('config.loki.pod_management_policy') not in [None, 'OrderedReady', 'Parallel']:
+            raise InvalidParamError('Unknown Loki pod management policy: "{}"'.format(
+                self.option_get('config.loki.pod_management_policy')))
+        if (self.option_get('kubernetes.volumes.loki-data') is None) == \
+                (self.option_get('kubernetes.volumeclaimtemplates.loki-data') is None):
+            raise InvalidParamError('Exactly one of the "kubernetes.volumes.loki-data" and '
+                                    '"kubernetes.volumeclaimtemplates.loki-data" options must be set')
+        if self.option_get('config.loki.replicas') > 1:
+            if self.option_get('config.loki.storage.type') != 's3':
+                raise InvalidParamError('Loki replicas require the "s3" storage type, with filesystem storage each '
+                                        'replica can only query the chunks it flushed')
+            if self._loki_data_is_claim():
+                raise InvalidParamError('Loki replicas cannot share the "kubernetes.volumes.loki-data" claim, use '
+                                        '"kubernetes.volumeclaimtemplates.loki-data" for a claim per replica')
+        if self.option_get('config.loki.ruler.enabled') is not False and \
+                self.option_get('config.loki.ruler.remote_write_url') is None and \
+                any('record' in rule for group in self.option_get('config.loki.ruler.rule_groups')
+                    for rule in group.get('rules', [])):
+            raise InvalidParamError('Loki recording rules require a ruler remote write url')
+        if self.option_get('config.loki.ruler.enabled') is not False and \
+                self.option_get('config.loki.ruler.remote_write_url') is not None:
+            loki_version = self._loki_image_version()
+            if loki_version is not None and loki_version < (2, 3):
+                raise InvalidParamError('Loki ruler remote write requires Loki 2.3 or later, the "container.loki" '
+                                        'image is "{}"'.format(self.option_get('container.loki')))
+        if self.option_get('config.loki.storage.type') not in ['filesystem', 's3']:
+            raise InvalidParamError('Unknown Loki storage type: "{}"'.format(
+                self.option_get('config.loki.storage.type')))
+        if self.option_get('enable.minio') is not False:
+            if self.option_get('config.loki.storage.type') != 's3':
+                raise InvalidParamError('MinIO requires the "s3" Loki storage type')
+            if self.option_get('config.loki.storage.s3.access_key_id') is None or \
+                    self.option_get('config.loki.storage.s3.secret_access_key') is None:
+                raise InvalidParamError('MinIO requires the S3 access key id and secret access key')
+        if self.option_get('config.loki.storage.type') == 's3':
+            if (self.option_get('config.loki.storage.s3.schema_from') is None) == \
+                    (self.option_get('config.loki.storage.s3.schema_replace') is False):
+                raise InvalidParamError('Exactly one of the "config.loki.storage.s3.schema_from" and '
+                                        '"config.loki.storage.s3.schema_replace" options must be set')
+            self._loki_s3_schema_from()  # validate the date
+
         if self.option_get('config.authorization.serviceaccount_create') is not False:
             serviceaccount_name = self.basename()
         else:
@@ -151,6 +254,18 @@ class LokiStackBuilder(Builder):
             'service-account': serviceaccount_name,
         })
 
+        if self.option_get('config.loki.ruler.enabled') is not False:
+            self.object_names_init({
+                'loki-rules-config': self.basename('-loki-rules'),
+            })
+
+        if self.option_get('enable.minio') is not False:
+            self.object_names_init({
+                'minio-service': self.basename('-minio'),
+                'minio-statefulset': self.basename('-minio'),
+                'minio-pod-label-app': self.basename('-minio'),
+            })
+
         loki_config = self._create_loki_config()
         loki_config.ensure_build_names(loki_config.BUILD_CONFIG, loki_config.BUILD_SERVICE)
 
@@ -183,7 +298,14 @@ class LokiStackBuilder(Builder):
                 'grafana-service': granana_config.object_name('service'),
             })
 
-        self._default_object_names = copy.deepcopy(self.object_names())
+        if self.option_get('enable.loadtest') is not False:
+            self.object_names_init({
+                'loadtest-generator': self.basename('-loadtest-generator'),
+                'loadtest-generator-pod-label-app': self.basename('-loadtest-generator'),
+                'loadtest-query': self.basename('-loadtest-query'),
+            })
+
+        self._default_object_names = dict(self.object_names())
 
     def option_get(self, name: str):
         return self.kubragen.option_root_get(self.options, name)
@@ -195,7 +317,10 @@ class LokiStackBuilder(Builder):
         return self._namespace
 
     def build_names(self) -> Sequence[TBuild]:
-        return [self.BUILD_ACCESSCONTROL, self.BUILD_CONFIG, self.BUILD_SERVICE]
+        ret = [self.BUILD_ACCESSCONTROL, self.BUILD_CONFIG, self.BUILD_SERVICE]
+        if self.option_get('enable.loadtest') is not False:
+            ret.append(self.BUILD_LOADTEST)
+        return ret
 
     def build_names_required(self) -> Sequence[TBuild]:
         ret = [self.BUILD_CONFIG, self.BUILD_SERVICE]
@@ -212,22 +337,33 @@ class LokiStackBuilder(Builder):
             self.BUILDITEM_PROMTAIL_CLUSTER_ROLE_BINDING,
             self.BUILDITEM_PROMTAIL_DAEMONSET,
             self.BUILDITEM_LOKI_CONFIG_SECRET,
+            self.BUILDITEM_LOKI_RULES_CONFIG,
             self.BUILDITEM_LOKI_SERVICE_HEADLESS,
             self.BUILDITEM_LOKI_SERVICE,
             self.BUILDITEM_LOKI_STATEFULSET,
             self.BUILDITEM_GRAFANA_DEPLOYMENT,
             self.BUILDITEM_GRAFANA_SERVICE,
+            self.BUILDITEM_MINIO_SERVICE,
+            self.BUILDITEM_MINIO_STATEFULSET,
+            self.BUILDITEM_LOADTEST_GENERATOR,
+            self.BUILDITEM_LOADTEST_QUERY,
         ]
 
     def internal_build(self, buildname: TBuild) -> Sequence[ObjectItem]:
         if buildname == self.BUILD_ACCESSCONTROL:
-            return self.internal_build_accesscontrol()
+            ret = self.internal_build_accesscontrol()
         elif buildname == self.BUILD_CONFIG:
-            return self.internal_build_config()
+            ret = self.internal_build_config()
         elif buildname == self.BUILD_SERVICE:
-            return self.internal_build_service()
+            ret = self.internal_build_service()
+        elif buildname == self.BUILD_LOADTEST:
+            ret = self.internal_build_loadtest()
         else:
             raise InvalidNameError('Invalid build name: "{}"'.format(buildname))
+        # identical text between objects and stacks, like the rendered config files, is stored only once
+        for o in ret:
+            share_immutable(o)
+        return ret
 
     def internal_build_accesscontrol(self) -> Sequence[ObjectItem]:
         ret: List[ObjectItem] = []
@@ -258,6 +394,21 @@ class LokiStackBuilder(Builder):
         ret.extend(self._build_result_change(
             self._create_loki_config().build(LokiBuilder.BUILD_CONFIG), 'loki'))
 
+        if self.option_get('config.loki.ruler.enabled') is not False:
+            ret.append(Object({
+                'apiVersion': 'v1',
+                'kind': 'ConfigMap',
+                'metadata': {
+                    'name': self.object_name('loki-rules-config'),
+                    'namespace': self.namespace(),
+                },
+                'data': {
+                    'rules.yaml': LiteralStr(ConfigFileRender_Yaml().render(ConfigFileOutput_Dict({
+                        'groups': self.option_get('config.loki.ruler.rule_groups'),
+                    }))),
+                }
+            }, name=self.BUILDITEM_LOKI_RULES_CONFIG, source=self.SOURCE_NAME, instance=self.basename()))
+
         if self.option_get('enable.grafana') is not False:
             ret.extend(self._build_result_change(
                 self._create_granana_config().build(GrafanaBuilder.BUILD_CONFIG), 'grafana'))
@@ -267,6 +418,9 @@ class LokiStackBuilder(Builder):
     def internal_build_service(self) -> Sequence[ObjectItem]:
         ret: List[ObjectItem] = []
 
+        if self.option_get('enable.minio') is not False:
+            ret.extend(self.internal_build_service_minio())
+
         ret.extend(self._build_result_change(
             self._create_loki_config().build(LokiBuilder.BUILD_SERVICE), 'loki'))
 
@@ -279,6 +433,218 @@ class LokiStackBuilder(Builder):
 
         return ret
 
+    def internal_build_service_minio(self) -> Sequence[ObjectItem]:
+        ret: List[ObjectItem] = []
+
+        ret.extend([
+            Object({
+                'apiVersion': 'v1',
+                'kind': 'Service',
+                'metadata': {
+                    'name': self.object_name('minio-service'),
+                    'namespace': self.namespace(),
+                    'labels': {
+                        'app': self.object_name('minio-pod-label-app'),
+                    },
+                },
+                'spec': {
+                    'type': 'ClusterIP',
+                    'ports': [{
+                        'port': 9000,
+                        'protocol': 'TCP',
+                        'name': 'http',
+                        'targetPort': 'http'
+                    }],
+                    'selector': {
+                        'app': self.object_name('minio-pod-label-app'),
+                    },
+                }
+            }, name=self.BUILDITEM_MINIO_SERVICE, source=self.SOURCE_NAME, instance=self.basename()),
+            Object({
+                'apiVersion': 'apps/v1',
+                'kind': 'StatefulSet',
+                'metadata': {
+                    'name': self.object_name('minio-statefulset'),
+                    'namespace': self.namespace(),
+                    'labels': {
+                        'app': self.object_name('minio-pod-label-app'),
+                    },
+                },
+                'spec': {
+                    'replicas': 1,
+                    'selector': {
+                        'matchLabels': {
+                            'app': self.object_name('minio-pod-label-app'),
+                        }
+                    },
+                    'serviceName': self.object_name('minio-service'),
+                    'template': {
+                        'metadata': {
+                            'labels': {
+                                'app': self.object_name('minio-pod-label-app'),
+                            },
+                        },
+                        'spec': {
+                            'containers': [{
+                                'name': 'minio',
+                                'image': self.option_get('container.minio'),
+                                'command': ['sh', '-c'],
+                                'args': [
+                                    'mkdir -p {} && exec minio server /data'.format(
+                                        posixpath.join('/data', self.option_get('config.loki.storage.s3.bucket'))),
+                                ],
+                                'env': [
+                                    KDataHelper_Env.info(base_value={
+                                        'name': 'MINIO_ACCESS_KEY',
+                                    }, value=self.option_get('config.loki.storage.s3.access_key_id')),
+                                    KDataHelper_Env.info(base_value={
+                                        'name': 'MINIO_SECRET_KEY',
+                                    }, value=self.option_get('config.loki.storage.s3.secret_access_key')),
+                                ],
+                                'ports': [{
+                                    'name': 'http',
+                                    'containerPort': 9000,
+                                    'protocol': 'TCP'
+                                }],
+                                'volumeMounts': [{
+                                    'name': 'data',
+                                    'mountPath': '/data'
+                                }],
+                                'readinessProbe': {
+                                    'httpGet': {
+                                        'path': '/minio/health/ready',
+                                        'port': 'http'
+                                    },
+                                    'initialDelaySeconds': 10
+                                },
+                                'resources': ValueData(value=self.option_get('kubernetes.resources.minio-statefulset'),
+                                                       disabled_if_none=True),
+                            }],
+                            'volumes': [
+                                KDataHelper_Volume.info(base_value={
+                                    'name': 'data',
+                                }, value=self.option_get('kubernetes.volumes.minio-data')),
+                            ]
+                        }
+                    }
+                }
+            }, name=self.BUILDITEM_MINIO_STATEFULSET, source=self.SOURCE_NAME, instance=self.basename()),
+        ])
+
+        return ret
+
+    def internal_build_loadtest(self) -> Sequence[ObjectItem]:
+        if self.option_get('enable.loadtest') is not True:
+            raise InvalidParamError('Load test is not enabled')
+
+        ret: List[ObjectItem] = []
+
+        query = self.option_get('config.loadtest.query')
+        if query is None:
+            query = 'sum(rate({{app="{}"}}[1m]))'.format(self.object_name('loadtest-generator-pod-label-app'))
+
+        ret.extend([
+            Object({
+                'apiVersion': 'apps/v1',
+                'kind': 'Deployment',
+                'metadata': {
+                    'name': self.object_name('loadtest-generator'),
+                    'namespace': self.namespace(),
+                    'labels': {
+                        'app': self.object_name('loadtest-generator-pod-label-app'),
+                    },
+                },
+                'spec': {
+                    'replicas': self.option_get('config.loadtest.streams'),
+                    'selector': {
+                        'matchLabels': {
+                            'app': self.object_name('loadtest-generator-pod-label-app'),
+                        }
+                    },
+                    'template': {
+                        'metadata': {
+                            'labels': {
+                                'app': self.object_name('loadtest-generator-pod-label-app'),
+                            },
+                        },
+                        'spec': {
+                            'containers': [{
+                                'name': 'generator',
+                                'image': self.option_get('container.loadtest-generator'),
+                                'command': ['awk'],
+                                'args': [
+                                    # each stream generates its share of the total rate, the fractional part
+                                    # is carried over to the next second
+                                    '-v', 'rate={:g}'.format(self.option_get('config.loadtest.lines_per_second') /
+                                                             self.option_get('config.loadtest.streams')),
+                                    '-v', 'size={}'.format(self.option_get('config.loadtest.line_size')),
+                                    'BEGIN { p = ""; while (length(p) < size) p = p "x"; '
+                                    'while (1) { due += rate; n = int(due); due -= n; '
+                                    'for (i = 0; i < n; i++) { printf "seq=%d level=info msg=%s\\n", '
+                                    'seq++, p }; fflush(); system("sleep 1") } }',
+                                ],
+                            }],
+                        }
+                    }
+                }
+            }, name=self.BUILDITEM_LOADTEST_GENERATOR, source=self.SOURCE_NAME, instance=self.basename()),
+            Object({
+                'apiVersion': 'batch/v1',
+                'kind': 'Job',
+                'metadata': {
+                    'name': self.object_name('loadtest-query'),
+                    'namespace': self.namespace(),
+                },
+                'spec': {
+                    'parallelism': self.option_get('config.loadtest.query_concurrency'),
+                    'completions': self.option_get('config.loadtest.query_concurrency'),
+                    'backoffLimit': 0,
+                    'template': {
+                        'spec': {
+                            'restartPolicy': 'Never',
+                            'containers': [{
+                                'name': 'query',
+                                'image': self.option_get('container.loadtest-query'),
+                                'command': ['sh', '-c'],
+                                'args': [
+                                    'end=$(( $(date +%s) + QUERY_DURATION )); '
+                                    'while [ $(date +%s) -lt $end ]; do '
+                                    'curl -s -o /dev/null -w "%{http_code} %{time_total}\\n" -G '
+                                    '"$LOKI_URL/loki/api/v1/query_range" --data-urlencode "query=$QUERY"; '
+                                    'done',
+                                ],
+                                'env': [{
+                                    'name': 'LOKI_URL',
+                                    'value': 'http://{}:{}'.format(self.object_name('loki-service'),
+                                                                   self.option_get('config.loki.service_port')),
+                                }, {
+                                    'name': 'QUERY',
+                                    'value': query,
+                                }, {
+                                    'name': 'QUERY_DURATION',
+                                    'value': str(self.option_get('config.loadtest.query_duration')),
+                                }],
+                            }],
+                        }
+                    }
+                }
+            }, name=self.BUILDITEM_LOADTEST_QUERY, source=self.SOURCE_NAME, instance=self.basename()),
+        ])
+
+        return ret
+
+    def loki_configfile_get(self) -> str:
+        """
+        Returns the rendered Loki config file.
+        """
+        return self._create_loki_config().loki_configfile_get()
+
+    def promtail_configfile_get(self) -> str:
+        """
+        Returns the rendered Promtail config file.
+        """
+        return self._create_promtail_config().promtail_configfile_get()
+
     def _build_result_change(self, items: Sequence[ObjectItem], name_prefix: str) -> Sequence[ObjectItem]:
         for o in items:
             if isinstance(o, Object):
@@ -295,6 +661,284 @@ class LokiStackBuilder(Builder):
                     ret[dname[len(prefix):]] = dvalue
         return ret
 
+    def _configfile_extend(self, configfile: Any, optionname: str, extensions: Sequence[ConfigFileExtension]) -> Any:
+        """
+        Returns a copy of the config file with the extensions appended, without changing the user's instance.
+        """
+        if len(extensions) == 0 or configfile is None:
+            return configfile
+        if not isinstance(configfile, ConfigFile_Extend):
+            raise InvalidParamError('Option "{}" must be an extensible ConfigFile with the current options'.format(
+                optionname))
+        ret = copy.copy(configfile)
+        ret.extensions = [*configfile.extensions, *extensions]
+        return ret
+
+    def _loki_replication_factor(self) -> int:
+        if self.option_get('config.loki.replication_factor') is not None:
+            return self.option_get('config.loki.replication_factor')
+        # a push needs replication_factor / 2 + 1 ingesters, so with less than 3 replicas any replication would
+        # reject all pushes while one pod restarts
+        if self.option_get('config.loki.replicas') >= 3:
+            return 3
+        return 1
+
+    def _loki_configfile_extensions(self) -> List[ConfigFileExtension]:
+        ret: List[ConfigFileExtension] = []
+        if not self.object_exists('loki-service-headless'):
+            # still initializing object names, the config file is not rendered at this point
+            return ret
+        if self.option_get('config.loki.replicas') > 1:
+            ret.append(LokiConfigFileExt_Memberlist(
+                join_members=['{}:{}'.format(self.object_name('loki-service-headless'),
+                                             self.option_get('config.loki.memberlist_port'))],
+                replication_factor=self._loki_replication_factor(),
+                bind_port=self.option_get('config.loki.memberlist_port')))
+        if self.option_get('config.loki.storage.type') == 's3':
+            minio = self.option_get('enable.minio') is not False
+            ret.append(LokiConfigFileExt_S3(
+                bucket=self.option_get('config.loki.storage.s3.bucket'),
+                endpoint=self._loki_s3_option(
+                    'endpoint', '{}:9000'.format(self.object_name('minio-service')) if minio else None),
+                region=self.option_get('config.loki.storage.s3.region'),
+                insecure=self._loki_s3_option('insecure', minio),
+                force_path_style=self._loki_s3_option('force_path_style', minio),
+                schema_from=self._loki_s3_schema_from()))
+        if self.option_get('config.loki.ruler.enabled') is not False:
+            ret.append(LokiConfigFileExt_Ruler(
+                rules_directory=self.LOKI_RULES_PATH,
+                evaluation_interval=self.option_get('config.loki.ruler.evaluation_interval'),
+                alertmanager_url=self.option_get('config.loki.ruler.alertmanager_url'),
+                remote_write_url=self.option_get('config.loki.ruler.remote_write_url'),
+                sharding=self.option_get('config.loki.replicas') > 1))
+        return ret
+
+    def _loki_s3_option(self, name: str, default_value: Any) -> Any:
+        ret = self.option_get('config.loki.storage.s3.{}'.format(name))
+        if ret is None:
+            return default_value
+        return ret
+
+    def _loki_s3_schema_from(self) -> Optional[datetime.date]:
+        ret = self.option_get('config.loki.storage.s3.schema_from')
+        if ret is None or isinstance(ret, datetime.date):
+            return ret
+        try:
+            return datetime.date.fromisoformat(ret)
+        except ValueError:
+            raise InvalidParamError('Invalid "config.loki.storage.s3.schema_from" date: "{}"'.format(ret)) from None
+
+    def _loki_configfile(self) -> Any:
+        config = self.option_get('config.loki.loki_config')
+        extensions = self._loki_configfile_extensions()
+        if config is None and len(extensions) > 0:
+            return LokiConfigFile(extensions=extensions)
+        return self._configfile_extend(config, 'config.loki.loki_config', extensions)
+
+    def _loki_image_version(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns the major and minor version from the Loki image tag, or None if the tag is not a version.
+        """
+        image = self.option_get('container.loki')
+        if '@' in image:
+            return None
+        name, _, tag = image.rpartition(':')
+        if name == '' or '/' in tag:
+            return None
+        match = re.match(r'^v?(\d+)\.(\d+)', tag)
+        if match is None:
+            return None
+        return int(match.group(1)), int(match.group(2))
+
+    def _loki_data_volume(self) -> Any:
+        if self.option_get('kubernetes.volumeclaimtemplates.loki-data') is not None:
+            # placeholder, replaced by the claim template
+            return {'emptyDir': {}}
+        return self.option_get('kubernetes.volumes.loki-data')
+
+    def _loki_data_is_claim(self) -> bool:
+        value = self.option_get('kubernetes.volumes.loki-data')
+        if isinstance(value, KData_Value):
+            value = value.value
+        return isinstance(value, Mapping) and 'persistentVolumeClaim' in value
+
+    def _loki_pod_management_policy(self) -> Optional[str]:
+        if self.option_get('config.loki.pod_management_policy') is not None:
+            return self.option_get('config.loki.pod_management_policy')
+        if self.option_get('config.loki.replicas') > 1:
+            return 'Parallel'
+        return None
+
+    def _loki_jsonpatches(self) -> List[FilterJSONPatch]:
+        ret: List[FilterJSONPatch] = []
+        if self.option_get('kubernetes.volumeclaimtemplates.loki-data') is not None:
+            # the data volume is created for each replica from the claim template
+            ret.append(FilterJSONPatch(filters=ObjectFilter(names=[LokiBuilder.BUILDITEM_STATEFULSET]), patches=[
+                {'op': 'test', 'path': '/spec/template/spec/volumes/1/name', 'value': 'storage'},
+                {'op': 'remove', 'path': '/spec/template/spec/volumes/1'},
+                {'op': 'add', 'path': '/spec/volumeClaimTemplates', 'value': [{
+                    'metadata': {
+                        'name': 'storage',
+                    },
+                    'spec': self.option_get('kubernetes.volumeclaimtemplates.loki-data'),
+                }]},
+            ]))
+        if self._loki_pod_management_policy() is not None:
+            ret.append(FilterJSONPatch(filters=ObjectFilter(names=[LokiBuilder.BUILDITEM_STATEFULSET]), patches=[
+                {'op': 'replace', 'path': '/spec/podManagementPolicy', 'value': self._loki_pod_management_policy()},
+            ]))
+        if self.option_get('config.loki.replicas') > 1:
+            ret.extend([
+                FilterJSONPatch(filters=ObjectFilter(names=[LokiBuilder.BUILDITEM_SERVICE_HEADLESS]), patches=[
+                    {'op': 'add', 'path': '/spec/publishNotReadyAddresses', 'value': True},
+                    {'op': 'add', 'path': '/spec/ports/-', 'value': {
+                        'port': self.option_get('config.loki.memberlist_port'),
+                        'protocol': 'TCP',
+                        'name': 'memberlist',
+                        'targetPort': 'memberlist',
+                    }},
+                ]),
+                FilterJSONPatch(filters=ObjectFilter(names=[LokiBuilder.BUILDITEM_STATEFULSET]), patches=[
+                    {'op': 'replace', 'path': '/spec/replicas', 'value': self.option_get('config.loki.replicas')},
+                    {'op': 'add', 'path': '/spec/template/spec/containers/0/ports/-', 'value': {
+                        'name': 'memberlist',
+                        'containerPort': self.option_get('config.loki.memberlist_port'),
+                        'protocol': 'TCP',
+                    }},
+                ]),
+            ])
+        if self.option_get('config.loki.storage.type') == 's3':
+            env = []
+            for envname, optionname in [('AWS_ACCESS_KEY_ID', 'config.loki.storage.s3.access_key_id'),
+                                        ('AWS_SECRET_ACCESS_KEY', 'config.loki.storage.s3.secret_access_key')]:
+                if self.option_get(optionname) is not None:
+                    env.append(KDataHelper_Env.info(base_value={
+                        'name': envname,
+                    }, value=self.option_get(optionname)))
+            if len(env) > 0:
+                ret.append(FilterJSONPatch(filters=ObjectFilter(names=[LokiBuilder.BUILDITEM_STATEFULSET]), patches=[
+                    {'op': 'add', 'path': '/spec/template/spec/containers/0/env', 'value': env},
+                ]))
+        if self.option_get('config.loki.ruler.enabled') is not False:
+            ret.append(FilterJSONPatch(filters=ObjectFilter(names=[LokiBuilder.BUILDITEM_STATEFULSET]), patches=[
+                {'op': 'add', 'path': '/spec/template/spec/containers/0/volumeMounts/-', 'value': {
+                    'name': 'rules',
+                    'mountPath': posixpath.join(self.LOKI_RULES_PATH, self.option_get('config.loki.ruler.tenant')),
+                }},
+                {'op': 'add', 'path': '/spec/template/spec/volumes/-', 'value': {
+                    'name': 'rules',
+                    'configMap': {
+                        'name': self.object_name('loki-rules-config'),
+                    },
+                }},
+            ]))
+        return ret
+
+    def _promtail_configfile_extensions(self) -> List[ConfigFileExtension]:
+        ret: List[ConfigFileExtension] = []
+        if self.option_get('config.promtail.node_scoped_discovery') is not False:
+            ret.append(PromtailConfigFileExt_NodeScoped(placeholder=self.PROMTAIL_NODE_NAME_PLACEHOLDER))
+        return ret
+
+    def _promtail_configfile(self) -> Any:
+        config = self.option_get('config.promtail.promtail_config')
+        if config is None:
+            config = PromtailConfigFile(extensions=[PromtailConfigFileExt_Kubernetes()])
+        return self._configfile_extend(config, 'config.promtail.promtail_config',
+                                       self._promtail_configfile_extensions())
+
+    def _promtail_jsonpatches(self) -> List[FilterJSONPatch]:
+        ret: List[FilterJSONPatch] = []
+        if self.option_get('config.promtail.node_scoped_discovery') is not False:
+            # the config file is shared by all nodes, render the node name into a pod-local copy
+            ret.append(FilterJSONPatch(filters=ObjectFilter(names=[PromtailBuilder.BUILDITEM_DAEMONSET]), patches=[
+                {'op': 'add', 'path': '/spec/template/spec/initContainers', 'value': [{
+                    'name': 'config-node',
+                    'image': self.option_get('container.promtail'),
+                    'command': ['sh', '-c'],
+                    'args': ['sed "s/{}/$NODE_NAME/g" /etc/promtail/promtail.yaml > '
+                             '/etc/promtail-node/promtail.yaml'.format(self.PROMTAIL_NODE_NAME_PLACEHOLDER)],
+                    'env': [{
+                        'name': 'NODE_NAME',
+                        'valueFrom': {
+                            'fieldRef': {
+                                'fieldPath': 'spec.nodeName'
+                            }
+                        },
+                    }],
+                    'volumeMounts': [{
+                        'name': 'config',
+                        'mountPath': '/etc/promtail'
+                    },
+                    {
+                        'name': 'config-node',
+                        'mountPath': '/etc/promtail-node'
+                    }],
+                }]},
+                {'op': 'replace', 'path': '/spec/template/spec/containers/0/args/0',
+                 'value': '-config.file=/etc/promtail-node/promtail.yaml'},
+                {'op': 'add', 'path': '/spec/template/spec/containers/0/volumeMounts/-', 'value': {
+                    'name': 'config-node',
+                    'mountPath': '/etc/promtail-node'
+                }},
+                {'op': 'add', 'path': '/spec/template/spec/volumes/-', 'value': {
+                    'name': 'config-node',
+                    'emptyDir': {}
+                }},
+            ]))
+        return ret
+
+    def _grafana_configfile(self) -> Any:
+        config = self.option_get('config.grafana.grafana_config')
+        if self.option_get('config.grafana.loki_datasource.enabled') is False or \
+                (config is not None and not isinstance(config, ConfigFile_Extend)):
+            # a str config file is used as-is
+            return config
+        if self.option_get('config.grafana.loki_datasource.timeout') is None and \
+                self.option_get('config.grafana.loki_datasource.keepalive') is None:
+            # the data proxy settings apply to all datasources, only change them if requested
+            return config
+        extensions = [GrafanaConfigFileExt_DataProxy(
+            timeout=self.option_get('config.grafana.loki_datasource.timeout'),
+            keep_alive_seconds=self.option_get('config.grafana.loki_datasource.keepalive'))]
+        if config is None:
+            return GrafanaConfigFile(extensions=extensions)
+        return self._configfile_extend(config, 'config.grafana.grafana_config', extensions)
+
+    def _grafana_loki_datasource_timeout(self) -> int:
+        if self.option_get('config.grafana.loki_datasource.timeout') is not None:
+            return self.option_get('config.grafana.loki_datasource.timeout')
+        return self.GRAFANA_LOKI_DATASOURCE_TIMEOUT
+
+    def _grafana_datasources(self) -> Any:
+        datasources = self.option_get('config.grafana.provisioning.datasources')
+        if self.option_get('config.grafana.loki_datasource.enabled') is False:
+            return datasources
+        if datasources is None:
+            datasources = []
+        elif isinstance(datasources, str) or not isinstance(datasources, Sequence):
+            # str and ConfigFile datasources are used as-is
+            return datasources
+
+        name = self.option_get('config.grafana.loki_datasource.name')
+        if next((d for d in datasources if d.get('name') == name), None) is not None:
+            return datasources
+
+        json_data: Dict[str, Any] = {
+            'maxLines': self.option_get('config.grafana.loki_datasource.max_lines'),
+            'timeout': self._grafana_loki_datasource_timeout(),
+        }
+        if self.option_get('config.grafana.loki_datasource.derived_fields') is not None:
+            json_data['derivedFields'] = self.option_get('config.grafana.loki_datasource.derived_fields')
+        return [*datasources, {
+            'name': name,
+            'type': 'loki',
+            'access': 'proxy',
+            'url': 'http://{}:{}'.format(self.object_name('loki-service'), self.option_get('config.loki.service_port')),
+            'isDefault': next((d for d in datasources if d.get('isDefault') is True), None) is None,
+            'jsonData': json_data,
+        }]
+
     def _create_loki_config(self) -> LokiBuilder:
         try:
             ret = LokiBuilder(kubragen=self.kubragen, options=LokiOptions({
@@ -302,15 +946,18 @@ class LokiStackBuilder(Builder):
                 'namespace': self.namespace(),
                 'config': {
                     'prometheus_annotation': self.option_get('config.prometheus_annotation'),
-                    'loki_config': self.option_get('config.loki.loki_config'),
+                    'loki_config': self._loki_configfile(),
                     'service_port': self.option_get('config.loki.service_port'),
                     'authorization': {
                         'serviceaccount_use': self.object_name('service-account'),
                     },
                 },
+                'container': {
+                    'loki': self.option_get('container.loki'),
+                },
                 'kubernetes': {
                     'volumes': {
-                        'data': self.option_get('kubernetes.volumes.loki-data'),
+                        'data': self._loki_data_volume(),
                     },
                     'resources': {
                         'statefulset': self.option_get('kubernetes.resources.loki-statefulset'),
@@ -318,6 +965,9 @@ class LokiStackBuilder(Builder):
                 },
             }))
             ret.object_names_change(self._object_names_changed('loki-'))
+            loki_jsonpatches = self._loki_jsonpatches()
+            if len(loki_jsonpatches) > 0:
+                ret.jsonpatches(loki_jsonpatches)
             return ret
         except OptionError as e:
             raise OptionError('Grafana option error: {}'.format(str(e))) from e
@@ -326,16 +976,12 @@ class LokiStackBuilder(Builder):
 
     def _create_promtail_config(self) -> PromtailBuilder:
         try:
-            config = self.option_get('config.promtail.promtail_config')
-            if config is None:
-                config = PromtailConfigFile(extensions=[PromtailConfigFileExt_Kubernetes()])
-
             ret = PromtailBuilder(kubragen=self.kubragen, options=PromtailOptions({
                 'basename': self.basename('-promtail'),
                 'namespace': self.namespace(),
                 'config': {
                     'prometheus_annotation': self.option_get('config.prometheus_annotation'),
-                    'promtail_config': config,
+                    'promtail_config': self._promtail_configfile(),
                     'loki_url': 'http://{}:{}'.format(self.object_name('loki-service'),
                                                       self.option_get('config.loki.service_port')),
                     'authorization': {
@@ -355,6 +1001,9 @@ class LokiStackBuilder(Builder):
                 },
             }))
             ret.object_names_change(self._object_names_changed('promtail-'))
+            promtail_jsonpatches = self._promtail_jsonpatches()
+            if len(promtail_jsonpatches) > 0:
+                ret.jsonpatches(promtail_jsonpatches)
             return ret
         except OptionError as e:
             raise OptionError('Prometheus option error: {}'.format(str(e))) from e
@@ -370,11 +1019,11 @@ class LokiStackBuilder(Builder):
                 'basename': self.basename('-grafana'),
                 'namespace': self.namespace(),
                 'config': {
-                    'grafana_config': self.option_get('config.grafana.grafana_config'),
+                    'grafana_config': self._grafana_configfile(),
                     'install_plugins': self.option_get('config.grafana.install_plugins'),
                     'service_port': self.option_get('config.grafana.service_port'),
                     'provisioning': {
-                        'datasources': self.option_get('config.grafana.provisioning.datasources'),
+                        'datasources': self._grafana_datasources(),
                         'plugins': self.option_get('config.grafana.provisioning.plugins'),
                         'dashboards': self.option_get('config.grafana.provisioning.dashboards'),
                     },
@@ -0,0 +1,57 @@
+import argparse
+import contextlib
+import runpy
+import sys
+from typing import Optional, Sequence, List
+
+from kg_lokistack import LokiStackBuilder
+from kg_lokistack.advisor import advise, LokiStackAdviceLevel
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Lint a Loki Stack configuration for performance pitfalls. '
+                    'The script is executed, and every LokiStackBuilder found in its globals is inspected. '
+                    'The script is not run as "__main__", so its output code must be guarded by '
+                    '"if __name__ == \'__main__\'". Anything the script prints is sent to stderr, only the '
+                    'advices are printed to stdout.')
+    parser.add_argument('script', help='python script creating the builder, as "filename.py[:variable]"')
+    parser.add_argument('--min-level', choices=[l.name.lower() for l in LokiStackAdviceLevel], default='info',
+                        help='minimum level to report')
+    parser.add_argument('--fail-level', choices=[l.name.lower() for l in LokiStackAdviceLevel], default='warning',
+                        help='exit with status 1 if any advice has at least this level')
+    args = parser.parse_args(argv)
+
+    filename, _, variable = args.script.partition(':')
+    with contextlib.redirect_stdout(sys.stderr):
+        scriptglobals = runpy.run_path(filename, run_name='__kg_lokistack_advise__')
+    if variable != '':
+        if variable not in scriptglobals:
+            parser.error('Variable "{}" not found in "{}"'.format(variable, filename))
+        if not isinstance(scriptglobals[variable], LokiStackBuilder):
+            parser.error('Variable "{}" in "{}" is not a LokiStackBuilder'.format(variable, filename))
+        builders = [scriptglobals[variable]]
+    else:
+        builders = [v for v in scriptglobals.values() if isinstance(v, LokiStackBuilder)]
+    if len(builders) == 0:
+        parser.error('No LokiStackBuilder found in "{}"'.format(filename))
+
+    min_level = LokiStackAdviceLevel[args.min_level.upper()]
+    fail_level = LokiStackAdviceLevel[args.fail_level.upper()]
+
+    failed: bool = False
+    for builder in builders:
+        # the failure is decided on all the advices, min_level only filters the output
+        advices = advise(builder)
+        report = [a for a in advices if a.level >= min_level]
+        lines: List[str] = ['{}: {} advice(s)'.format(builder.basename(), len(report))]
+        lines.extend('  {}'.format(a) for a in report)
+        print('\n'.join(lines))
+        if any(a.level >= fail_level for a in advices):
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import copy
+import datetime
+from typing import Sequence, Optional, Dict, Any
+
+from kubragen.configfile import ConfigFileExtension, ConfigFile, ConfigFileExtensionData
+from kubragen.exception import InvalidParamError
+from kubragen.merger import Merger
+from kubragen.options import OptionGetter
+
+
+class LokiConfigFileExt_Memberlist(ConfigFileExtension):
+    """
+    Loki configuration extension to share the ingester and distributor rings between replicas using memberlist.
+
+    :param join_members: list of *host:port* addresses used to join the memberlist cluster, usually the Loki
+        headless service
+    :param replication_factor: number of ingesters that receive each stream
+    :param bind_port: memberlist gossip port
+    """
+    join_members: Sequence[str]
+    replication_factor: int
+    bind_port: int
+
+    def __init__(self, join_members: Sequence[str], replication_factor: int = 1, bind_port: int = 7946):
+        self.join_members = join_members
+        self.replication_factor = replication_factor
+        self.bind_port = bind_port
+
+    def process(self, configfile: ConfigFile, data: ConfigFileExtensionData, options: OptionGetter) -> None:
+        ring = data.data.setdefault('ingester', {}).setdefault('lifecycler', {}).setdefault('ring', {})
+        ring['kvstore'] = {
+            'store': 'memberlist',
+        }
+        ring['replication_factor'] = self.replication_factor
+
+        Merger.merge(data.data, {
+            'ingester': {
+                'lifecycler': {
+                    'join_after': '30s',
+                    'final_sleep': '0s',
+                },
+            },
+            'distributor': {
+                'ring': {
+                    'kvstore': {
+                        'store': 'memberlist',
+                    },
+                },
+            },
+        })
+        data.data['memberlist'] = {
+            'abort_if_cluster_join_fails': False,
+            'bind_port': self.bind_port,
+            'join_members': list(self.join_members),
+        }
+
+
+class PromtailConfigFileExt_NodeScoped(ConfigFileExtension):
+    """
+    Promtail configuration extension that restricts the pod Kubernetes service discovery to the pods of a node,
+    using a *spec.nodeName* field selector, so the API server only sends the pods of the node to each Promtail.
+
+    It must be added **after** the extensions that add scrape configs. The node name in the config is the
+    *placeholder* value, which must be replaced at runtime.
+
+    :param placeholder: the text that will be replaced by the node name
+    """
+    placeholder: str
+
+    def __init__(self, placeholder: str = '__KG_NODE_NAME__'):
+        self.placeholder = placeholder
+
+    def process(self, configfile: ConfigFile, data: ConfigFileExtensionData, options: OptionGetter) -> None:
+        for scrape_config in data.data.get('scrape_configs', []):
+            for sd_config in scrape_config.get('kubernetes_sd_configs', []):
+                if sd_config.get('role') != 'pod':
+                    continue
+                sd_config.setdefault('selectors', []).append({
+                    'role': 'pod',
+                    'field': 'spec.nodeName={}'.format(self.placeholder),
+                })
+
+
+class LokiConfigFileExt_Ruler(ConfigFileExtension):
+    """
+    Loki configuration extension to enable the ruler, evaluating the rule files from a local directory.
+
+    Recording rules and remote write require Loki 2.3 or later.
+
+    :param rules_directory: directory containing one subdirectory per tenant with the rule files
+    :param evaluation_interval: how often the rules are evaluated
+    :param alertmanager_url: the Alertmanager url to send alerts to
+    :param remote_write_url: the Prometheus remote write url to send recording rules results to
+    :param sharding: whether to shard the rules between the replicas using the memberlist ring
+    """
+    rules_directory: str
+    evaluation_interval: str
+    alertmanager_url: Optional[str]
+    remote_write_url: Optional[str]
+    sharding: bool
+
+    def __init__(self, rules_directory: str, evaluation_interval: str = '1m', alertmanager_url: Optional[str] = None,
+                 remote_write_url: Optional[str] = None, sharding: bool = False):
+        self.rules_directory = rules_directory
+        self.evaluation_interval = evaluation_interval
+        self.alertmanager_url = alertmanager_url
+        self.remote_write_url = remote_write_url
+        self.sharding = sharding
+
+    def process(self, configfile: ConfigFile, data: ConfigFileExtensionData, options: OptionGetter) -> None:
+        ruler: Dict[str, Any] = {
+            'storage': {
+                'type': 'local',
+                'local': {
+                    'directory': self.rules_directory,
+                },
+            },
+            'rule_path': '/data/loki/rules-temp',
+            'evaluation_interval': self.evaluation_interval,
+            'enable_api': True,
+        }
+        if self.alertmanager_url is not None:
+            ruler['alertmanager_url'] = self.alertmanager_url
+        if self.remote_write_url is not None:
+            ruler['wal'] = {
+                'dir': '/data/loki/ruler-wal',
+            }
+            ruler['remote_write'] = {
+                'enabled': True,
+                'client': {
+                    'url': self.remote_write_url,
+                },
+            }
+        if self.sharding:
+            ruler['enable_sharding'] = True
+            ruler['ring'] = {
+                'kvstore': {
+                    'store': 'memberlist',
+                },
+            }
+        Merger.merge(data.data, {
+            'ruler': ruler,
+        })
+
+
+class LokiConfigFileExt_S3(ConfigFileExtension):
+    """
+    Loki configuration extension to store chunks and the boltdb-shipper index on S3-compatible object storage.
+
+    Credentials are not written to the config file, they are read by Loki from the *AWS_ACCESS_KEY_ID* and
+    *AWS_SECRET_ACCESS_KEY* environment variables.
+
+    If *schema_from* is set, a new schema period using S3 starts at this date, and the existing periods and
+    storage settings are kept, so the data already stored can still be read. The boltdb-shipper shared store
+    is not changed, as it is used for the index of all periods. Otherwise, all the periods are changed to S3,
+    which is only correct for a stack without existing data.
+
+    :param bucket: the bucket name
+    :param endpoint: the S3 endpoint, for S3-compatible storages
+    :param region: the bucket region
+    :param insecure: whether to use plain HTTP to connect to the endpoint
+    :param force_path_style: whether to use path-style bucket urls, required by most S3-compatible storages
+    :param schema_from: the date the S3 schema period starts
+    """
+    bucket: str
+    endpoint: Optional[str]
+    region: Optional[str]
+    insecure: bool
+    force_path_style: bool
+    schema_from: Optional[datetime.date]
+
+    def __init__(self, bucket: str, endpoint: Optional[str] = None, region: Optional[str] = None,
+                 insecure: bool = False, force_path_style: bool = False,
+                 schema_from: Optional[datetime.date] = None):
+        self.bucket = bucket
+        self.endpoint = endpoint
+        self.region = region
+        self.insecure = insecure
+        self.force_path_style = force_path_style
+        self.schema_from = schema_from
+
+    def process(self, configfile: ConfigFile, data: ConfigFileExtensionData, options: OptionGetter) -> None:
+        aws: Dict[str, Any] = {
+            'bucketnames': self.bucket,
+            'insecure': self.insecure,
+            's3forcepathstyle': self.force_path_style,
+        }
+        if self.endpoint is not None:
+            aws['endpoint'] = self.endpoint
+        if self.region is not None:
+            aws['region'] = self.region
+
+        storage_config = data.data.setdefault('storage_config', {})
+        storage_config['aws'] = aws
+        schemas = data.data.setdefault('schema_config', {}).setdefault('configs', [])
+
+        if self.schema_from is not None:
+            if len(schemas) == 0:
+                raise InvalidParamError('A schema period is required to add the S3 period')
+            last_schema = schemas[-1]
+            if _schema_date(last_schema.get('from')) >= self.schema_from:
+                raise InvalidParamError('The S3 schema period must start after "{}"'.format(last_schema.get('from')))
+            schema = copy.deepcopy(last_schema)
+            schema['from'] = self.schema_from
+            schema['object_store'] = 's3'
+            schemas.append(schema)
+            return
+
+        storage_config.pop('filesystem', None)
+        storage_config.setdefault('boltdb_shipper', {})['shared_store'] = 's3'
+
+        for schema in schemas:
+            schema['object_store'] = 's3'
+
+        if 'compactor' in data.data:
+            data.data['compactor']['shared_store'] = 's3'
+
+
+class GrafanaConfigFileExt_DataProxy(ConfigFileExtension):
+    """
+    Grafana configuration extension to set the data proxy HTTP settings, used by the queries of all proxy
+    access datasources.
+
+    :param timeout: HTTP request timeout in seconds
+    :param keep_alive_seconds: HTTP keep-alive time of the connections to the datasources in seconds
+    """
+    timeout: Optional[int]
+    keep_alive_seconds: Optional[int]
+
+    def __init__(self, timeout: Optional[int] = None, keep_alive_seconds: Optional[int] = None):
+        self.timeout = timeout
+        self.keep_alive_seconds = keep_alive_seconds
+
+    def process(self, configfile: ConfigFile, data: ConfigFileExtensionData, options: OptionGetter) -> None:
+        dataproxy: Dict[str, Any] = {}
+        if self.timeout is not None:
+            dataproxy['timeout'] = self.timeout
+        if self.keep_alive_seconds is not None:
+            dataproxy['keep_alive_seconds'] = self.keep_alive_seconds
+        if len(dataproxy) > 0:
+            Merger.merge(data.data, {
+                'dataproxy': dataproxy,
+            })
+
+
+def _schema_date(value: Any) -> datetime.date:
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value))
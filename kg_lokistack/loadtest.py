@@ -0,0 +1,165 @@
+import re
+import time
+from typing import Optional, Sequence, List, Tuple, Mapping, Dict
+from urllib.request import urlopen
+
+from kubragen.exception import InvalidParamError
+
+_METRIC_LINE = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?P<labels>.*)\})?\s+(?P<value>\S+)')
+_METRIC_LABEL = re.compile(r'(?P<name>[a-zA-Z_][a-zA-Z0-9_]*)="(?P<value>(?:[^"\\]|\\.)*)"')
+
+
+class LokiStackMetricsSample:
+    """
+    A sample of Prometheus metrics collected from Loki and Promtail at a point in time.
+
+    :param timestamp: the time the sample was collected, in seconds
+    :param metrics: list of *(name, labels, value)* metrics
+    """
+    timestamp: float
+    metrics: List[Tuple[str, Mapping[str, str], float]]
+
+    def __init__(self, timestamp: float, metrics: List[Tuple[str, Mapping[str, str], float]]):
+        self.timestamp = timestamp
+        self.metrics = metrics
+
+    def value(self, name: str, **labels: str) -> float:
+        """
+        Returns the sum of the metric values with the name, filtering by the passed labels.
+
+        :param name: the metric name
+        :param labels: label values that must match
+        :return: the sum of the matched values
+        """
+        ret = 0.0
+        for mname, mlabels, mvalue in self.metrics:
+            if mname == name and all(mlabels.get(lname) == lvalue for lname, lvalue in labels.items()):
+                ret += mvalue
+        return ret
+
+
+class LokiStackLoadTestResult:
+    """
+    Load test results calculated between two metrics samples.
+
+    :param duration: seconds between the samples
+    :param lines_per_second: log lines received by the Loki distributors per second
+    :param bytes_per_second: log bytes received by the Loki distributors per second
+    :param promtail_entries_per_second: log entries sent by Promtail per second
+    :param promtail_dropped_entries: log entries dropped by Promtail
+    :param push_latency: average Loki push request latency in seconds, None if no requests
+    :param query_latency: average Loki range query latency in seconds, None if no requests
+    """
+    duration: float
+    lines_per_second: float
+    bytes_per_second: float
+    promtail_entries_per_second: float
+    promtail_dropped_entries: float
+    push_latency: Optional[float]
+    query_latency: Optional[float]
+
+    def __init__(self, duration: float, lines_per_second: float, bytes_per_second: float,
+                 promtail_entries_per_second: float, promtail_dropped_entries: float,
+                 push_latency: Optional[float], query_latency: Optional[float]):
+        self.duration = duration
+        self.lines_per_second = lines_per_second
+        self.bytes_per_second = bytes_per_second
+        self.promtail_entries_per_second = promtail_entries_per_second
+        self.promtail_dropped_entries = promtail_dropped_entries
+        self.push_latency = push_latency
+        self.query_latency = query_latency
+
+    def __str__(self):
+        return '\n'.join([
+            'duration: {:.1f}s'.format(self.duration),
+            'loki lines/s: {:.1f}'.format(self.lines_per_second),
+            'loki bytes/s: {:.1f}'.format(self.bytes_per_second),
+            'promtail entries/s: {:.1f}'.format(self.promtail_entries_per_second),
+            'promtail dropped entries: {:.0f}'.format(self.promtail_dropped_entries),
+            'loki push latency: {}'.format(_format_latency(self.push_latency)),
+            'loki query latency: {}'.format(_format_latency(self.query_latency)),
+        ])
+
+
+def loadtest_metrics_parse(text: str) -> List[Tuple[str, Mapping[str, str], float]]:
+    """
+    Parses metrics in the Prometheus text exposition format.
+
+    :param text: the metrics text
+    :return: list of *(name, labels, value)* metrics
+    """
+    ret: List[Tuple[str, Mapping[str, str], float]] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        m = _METRIC_LINE.match(line)
+        if m is None:
+            continue
+        labels: Dict[str, str] = {}
+        if m.group('labels') is not None:
+            for lm in _METRIC_LABEL.finditer(m.group('labels')):
+                labels[lm.group('name')] = lm.group('value')
+        try:
+            value = float(m.group('value'))
+        except ValueError:
+            continue
+        ret.append((m.group('name'), labels, value))
+    return ret
+
+
+def loadtest_sample(loki_url: str, promtail_urls: Sequence[str] = ()) -> LokiStackMetricsSample:
+    """
+    Collects the current metrics from Loki and Promtail, usually accessed using ```kubectl port-forward```.
+
+    :param loki_url: the Loki base url, like ```http://localhost:3100```
+    :param promtail_urls: list of Promtail base urls, like ```http://localhost:3101```
+    :return: the metrics sample
+    """
+    metrics: List[Tuple[str, Mapping[str, str], float]] = []
+    timestamp = time.time()
+    for url in [loki_url, *promtail_urls]:
+        try:
+            with urlopen('{}/metrics'.format(url.rstrip('/'))) as u:
+                metrics.extend(loadtest_metrics_parse(u.read().decode('utf-8')))
+        except Exception as e:
+            raise InvalidParamError('Error collecting metrics from "{}": {}'.format(url, str(e))) from e
+    return LokiStackMetricsSample(timestamp, metrics)
+
+
+def loadtest_result(start: LokiStackMetricsSample, end: LokiStackMetricsSample) -> LokiStackLoadTestResult:
+    """
+    Calculates the load test results between two metrics samples.
+
+    :param start: the sample collected before the load test
+    :param end: the sample collected after the load test
+    :return: the load test results
+    """
+    duration = end.timestamp - start.timestamp
+    if duration <= 0:
+        raise InvalidParamError('The end sample must be collected after the start sample')
+
+    def delta(name: str, **labels: str) -> float:
+        return end.value(name, **labels) - start.value(name, **labels)
+
+    def latency(route: str) -> Optional[float]:
+        count = delta('loki_request_duration_seconds_count', route=route)
+        if count <= 0:
+            return None
+        return delta('loki_request_duration_seconds_sum', route=route) / count
+
+    return LokiStackLoadTestResult(
+        duration=duration,
+        lines_per_second=delta('loki_distributor_lines_received_total') / duration,
+        bytes_per_second=delta('loki_distributor_bytes_received_total') / duration,
+        promtail_entries_per_second=delta('promtail_sent_entries_total') / duration,
+        promtail_dropped_entries=delta('promtail_dropped_entries_total'),
+        push_latency=latency('loki_api_v1_push'),
+        query_latency=latency('loki_api_v1_query_range'),
+    )
+
+
+def _format_latency(value: Optional[float]) -> str:
+    if value is None:
+        return '-'
+    return '{:.3f}s'.format(value)
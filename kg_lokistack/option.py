@@ -1,10 +1,11 @@
+import datetime
 from typing import Optional, Any, Mapping, Sequence
 
 from kubragen.configfile import ConfigFile
 from kubragen.kdata import KData_Secret
 from kubragen.kdatahelper import KDataHelper_Volume, KDataHelper_Env
 from kubragen.option import OptionDef, OptionDefFormat
-from kubragen.options import Options
+from kubragen.options import Options, OptionsBase
 
 
 class LokiStackOptions(Options):
@@ -38,10 +39,107 @@ class LokiStackOptions(Options):
           - Loki service port
           - int
           - 80
+        * - config |rarr| loki |rarr| replicas
+          - Loki StatefulSet replicas. If greater than 1, the rings are shared using memberlist over the headless
+            service. More than 1 replica requires the ```s3``` storage type, and a claim per replica
+            (```kubernetes.volumeclaimtemplates.loki-data```) instead of a persistent volume claim in
+            ```kubernetes.volumes.loki-data```
+          - int
+          - 1
+        * - config |rarr| loki |rarr| pod_management_policy
+          - Loki StatefulSet pod management policy, ```OrderedReady``` or ```Parallel```. If not set, uses
+            ```Parallel``` when there is more than 1 replica. This field cannot be changed on an existing
+            StatefulSet, when scaling an existing stack from 1 replica either delete the StatefulSet before applying
+            (```kubectl delete statefulset --cascade=orphan```) or set ```OrderedReady```
+          - str
+          -
+        * - config |rarr| loki |rarr| replication_factor
+          - Loki ingester replication factor. Each push must be written to a quorum of
+            ```replication_factor / 2 + 1``` ingesters, so with a replication factor of 2 both ingesters must be up,
+            and a single pod restart rejects all pushes. If not set, uses 3 when there are at least 3 replicas,
+            otherwise 1
+          - int
+          -
+        * - config |rarr| loki |rarr| memberlist_port
+          - Loki memberlist gossip port
+          - int
+          - 7946
+        * - config |rarr| loki |rarr| ruler |rarr| enabled
+          - enable the Loki ruler. Recording rules and remote write require Loki 2.3 or later
+          - bool
+          - ```False```
+        * - config |rarr| loki |rarr| ruler |rarr| rule_groups
+          - ruler rule groups, in the Prometheus rule group format, stored in a ConfigMap
+          - Sequence[Mapping]
+          -
+        * - config |rarr| loki |rarr| ruler |rarr| tenant
+          - tenant the rules belong to
+          - str
+          - ```fake```
+        * - config |rarr| loki |rarr| ruler |rarr| evaluation_interval
+          - how often the rules are evaluated
+          - str
+          - ```1m```
+        * - config |rarr| loki |rarr| ruler |rarr| alertmanager_url
+          - Alertmanager url to send alerts to
+          - str
+          -
+        * - config |rarr| loki |rarr| ruler |rarr| remote_write_url
+          - Prometheus remote write url to send the recording rules results to. Required if there are recording rules.
+            Requires a Loki 2.3 or later ```container.loki``` image
+          - str
+          -
+        * - config |rarr| loki |rarr| storage |rarr| type
+          - Loki chunks and index storage, ```filesystem``` (the loki-data volume) or ```s3```
+          - str
+          - ```filesystem```
+        * - config |rarr| loki |rarr| storage |rarr| s3 |rarr| bucket
+          - S3 bucket name
+          - str
+          - ```loki```
+        * - config |rarr| loki |rarr| storage |rarr| s3 |rarr| endpoint
+          - S3 endpoint, for S3-compatible storages
+          - str
+          - the MinIO service if *enable.minio* is True
+        * - config |rarr| loki |rarr| storage |rarr| s3 |rarr| region
+          - S3 region
+          - str
+          -
+        * - config |rarr| loki |rarr| storage |rarr| s3 |rarr| insecure
+          - use plain HTTP to connect to the endpoint
+          - bool
+          - ```True``` if *enable.minio* is True, else ```False```
+        * - config |rarr| loki |rarr| storage |rarr| s3 |rarr| force_path_style
+          - use path-style bucket urls
+          - bool
+          - ```True``` if *enable.minio* is True, else ```False```
+        * - config |rarr| loki |rarr| storage |rarr| s3 |rarr| access_key_id
+          - S3 access key id, also used as the MinIO access key
+          - str, :class:`KData_Value`, :class:`KData_ConfigMap`, :class:`KData_Secret`
+          -
+        * - config |rarr| loki |rarr| storage |rarr| s3 |rarr| secret_access_key
+          - S3 secret access key, also used as the MinIO secret key
+          - str, :class:`KData_Secret`
+          -
+        * - config |rarr| loki |rarr| storage |rarr| s3 |rarr| schema_from
+          - date the new S3 schema period starts, as a ```YYYY-MM-DD``` string. The existing schema periods and the
+            filesystem storage are kept, so the data already stored can still be read
+          - str, :class:`datetime.date`
+          -
+        * - config |rarr| loki |rarr| storage |rarr| s3 |rarr| schema_replace
+          - change all the existing schema periods to S3 instead of adding a new one. Only for stacks without
+            existing data. One of *schema_from* and *schema_replace* is required
+          - bool
+          - ```False```
         * - config |rarr| promtail |rarr| promtail_config
           - Promtail config file
           - str, ConfigFile
           - :class:`kg_promtail.PromtailConfigFile` with Kubernetes extension
+        * - config |rarr| promtail |rarr| node_scoped_discovery
+          - restrict the Kubernetes pod discovery of each Promtail to its own node, rendering the node name in the
+            config with an init container
+          - bool
+          - ```False```
         * - config |rarr| grafana |rarr| grafana_config
           - Grafana INI config file
           - str, :class:`kubragen.configfile.ConfigFile`
@@ -78,6 +176,33 @@ class LokiStackOptions(Options):
           - The maximum size of a Grafana dashboard config ConfigMap size (set None to disable check)
           - int
           - 250000
+        * - config |rarr| grafana |rarr| loki_datasource |rarr| enabled
+          - whether to provision a Loki datasource pointing to the Loki service. It is added to the
+            ```config.grafana.provisioning.datasources``` list, unless a datasource with the same name is
+            already there or the option is not a list
+          - bool
+          - ```True```
+        * - config |rarr| grafana |rarr| loki_datasource |rarr| name
+          - Loki datasource name
+          - str
+          - ```Loki```
+        * - config |rarr| grafana |rarr| loki_datasource |rarr| max_lines
+          - maximum number of log lines returned by a Loki datasource query
+          - int
+          - 1000
+        * - config |rarr| grafana |rarr| loki_datasource |rarr| timeout
+          - HTTP timeout of the Loki datasource queries in seconds. If set, it is also set as the Grafana data proxy
+            timeout, which applies to all the datasources
+          - int
+          - 60 on the Loki datasource
+        * - config |rarr| grafana |rarr| loki_datasource |rarr| keepalive
+          - HTTP keep-alive of the Grafana data proxy connections in seconds, applies to all the datasources
+          - int
+          -
+        * - config |rarr| grafana |rarr| loki_datasource |rarr| derived_fields
+          - Loki datasource derived fields, like links from trace ids to a tracing datasource
+          - Sequence
+          -
         * - config |rarr| grafana |rarr| admin |rarr| user
           - Grafana admin user name
           - str, :class:`KData_Value`, :class:`KData_ConfigMap`, :class:`KData_Secret`
@@ -102,10 +227,43 @@ class LokiStackOptions(Options):
           - whether to bind roles to service account
           - bool
           - ```True```
+        * - config |rarr| loadtest |rarr| streams
+          - load test log generator pods, each pod is a separate Loki stream. Changes the label cardinality
+            without changing the total volume
+          - int
+          - 4
+        * - config |rarr| loadtest |rarr| lines_per_second
+          - total log lines per second generated by all the streams, split evenly between them
+          - int
+          - 400
+        * - config |rarr| loadtest |rarr| line_size
+          - approximate size in bytes of each generated log line
+          - int
+          - 256
+        * - config |rarr| loadtest |rarr| query
+          - LogQL query run by the load test query Job
+          - str
+          - ```sum(rate({app="<generator pod label app>"}[1m]))```
+        * - config |rarr| loadtest |rarr| query_concurrency
+          - number of parallel query load test pods
+          - int
+          - 2
+        * - config |rarr| loadtest |rarr| query_duration
+          - how long the query load test runs, in seconds
+          - int
+          - 300
         * - enable |rarr| grafana
           - whether grafana will be deployed
           - bool
           - ```False```
+        * - enable |rarr| minio
+          - whether a single node MinIO will be deployed as the S3 storage, for local/dev use
+          - bool
+          - ```False```
+        * - enable |rarr| loadtest
+          - whether the load test workload build is available
+          - bool
+          - ```False```
         * - container |rarr| promtail
           - promtail container image
           - str
@@ -118,14 +276,34 @@ class LokiStackOptions(Options):
           - Grafana container image
           - str
           - ```grafana/grafana:<version>```
+        * - container |rarr| minio
+          - MinIO container image
+          - str
+          - ```minio/minio:<version>```
+        * - container |rarr| loadtest-generator
+          - load test log generator container image
+          - str
+          - ```busybox:<version>```
+        * - container |rarr| loadtest-query
+          - load test query container image
+          - str
+          - ```curlimages/curl:<version>```
         * - kubernetes |rarr| volumes |rarr| loki-data
-          - Loki Kubernetes data volume
+          - Loki Kubernetes data volume. Either this or ```kubernetes.volumeclaimtemplates.loki-data``` must be set
           - dict, :class:`KData_Value`, :class:`KData_ConfigMap`, :class:`KData_Secret`
           -
         * - kubernetes |rarr| volumes |rarr| grafana-data
           - Grafana Kubernetes data volume
           - Mapping, :class:`KData_Value`, :class:`KData_ConfigMap`, :class:`KData_Secret`
           - ```{'emptyDir': {}}```
+        * - kubernetes |rarr| volumes |rarr| minio-data
+          - MinIO Kubernetes data volume
+          - Mapping, :class:`KData_Value`, :class:`KData_ConfigMap`, :class:`KData_Secret`
+          - ```{'emptyDir': {}}```
+        * - kubernetes |rarr| volumeclaimtemplates |rarr| loki-data
+          - Loki Kubernetes data PersistentVolumeClaim spec, to create a claim for each replica
+          - Mapping
+          -
         * - kubernetes |rarr| resources |rarr| promtail-daemonset
           - Promtail Kubernetes StatefulSet resources
           - dict
@@ -138,7 +316,22 @@ class LokiStackOptions(Options):
           - Grafana Kubernetes Deployment resources
           - Mapping
           -
+        * - kubernetes |rarr| resources |rarr| minio-statefulset
+          - MinIO Kubernetes StatefulSet resources
+          - Mapping
+          -
     """
+    _shared_defined_options: Optional[Any] = None
+
+    def __init__(self, options: Optional[Any] = None):
+        if type(self).define_options is LokiStackOptions.define_options:
+            # the definitions are never changed, so all instances share the same ones
+            if LokiStackOptions._shared_defined_options is None:
+                LokiStackOptions._shared_defined_options = self.define_options()
+            OptionsBase.__init__(self, defined_options=LokiStackOptions._shared_defined_options, options=options)
+        else:
+            super().__init__(options)
+
     def define_options(self) -> Optional[Any]:
         """
         Declare the options for the Loki Stack builder.
@@ -153,9 +346,38 @@ class LokiStackOptions(Options):
                 'loki': {
                     'loki_config': OptionDef(allowed_types=[str, ConfigFile]),
                     'service_port': OptionDef(required=True, default_value=80, allowed_types=[int]),
+                    'replicas': OptionDef(required=True, default_value=1, allowed_types=[int]),
+                    'replication_factor': OptionDef(allowed_types=[int]),
+                    'memberlist_port': OptionDef(required=True, default_value=7946, allowed_types=[int]),
+                    'pod_management_policy': OptionDef(allowed_types=[str]),
+                    'ruler': {
+                        'enabled': OptionDef(required=True, default_value=False, allowed_types=[bool]),
+                        'rule_groups': OptionDef(default_value=[], allowed_types=[Sequence]),
+                        'tenant': OptionDef(required=True, default_value='fake', allowed_types=[str]),
+                        'evaluation_interval': OptionDef(required=True, default_value='1m', allowed_types=[str]),
+                        'alertmanager_url': OptionDef(allowed_types=[str]),
+                        'remote_write_url': OptionDef(allowed_types=[str]),
+                    },
+                    'storage': {
+                        'type': OptionDef(required=True, default_value='filesystem', allowed_types=[str]),
+                        's3': {
+                            'bucket': OptionDef(required=True, default_value='loki', allowed_types=[str]),
+                            'endpoint': OptionDef(allowed_types=[str]),
+                            'region': OptionDef(allowed_types=[str]),
+                            'insecure': OptionDef(allowed_types=[bool]),
+                            'force_path_style': OptionDef(allowed_types=[bool]),
+                            'access_key_id': OptionDef(format=OptionDefFormat.KDATA_ENV,
+                                                       allowed_types=[str, *KDataHelper_Env.allowed_kdata()]),
+                            'secret_access_key': OptionDef(format=OptionDefFormat.KDATA_ENV,
+                                                           allowed_types=[str, KData_Secret]),
+                            'schema_from': OptionDef(allowed_types=[str, datetime.date]),
+                            'schema_replace': OptionDef(required=True, default_value=False, allowed_types=[bool]),
+                        },
+                    },
                 },
                 'promtail': {
                     'promtail_config': OptionDef(allowed_types=[str, ConfigFile]),
+                    'node_scoped_discovery': OptionDef(required=True, default_value=False, allowed_types=[bool]),
                 },
                 'grafana': {
                     'grafana_config': OptionDef(allowed_types=[str, ConfigFile]),
@@ -170,11 +392,27 @@ class LokiStackOptions(Options):
                     'dashboards_path': OptionDef(required=True, default_value='/var/lib/grafana/dashboards',
                                                  allowed_types=[str]),
                     'dashboard_config_max_size': OptionDef(default_value=250000, allowed_types=[int]),
+                    'loki_datasource': {
+                        'enabled': OptionDef(required=True, default_value=True, allowed_types=[bool]),
+                        'name': OptionDef(required=True, default_value='Loki', allowed_types=[str]),
+                        'max_lines': OptionDef(required=True, default_value=1000, allowed_types=[int]),
+                        'timeout': OptionDef(allowed_types=[int]),
+                        'keepalive': OptionDef(allowed_types=[int]),
+                        'derived_fields': OptionDef(allowed_types=[Sequence]),
+                    },
                     'admin': {
                         'user': OptionDef(format=OptionDefFormat.KDATA_ENV, allowed_types=[str, *KDataHelper_Env.allowed_kdata()]),
                         'password': OptionDef(format=OptionDefFormat.KDATA_ENV, allowed_types=[str, KData_Secret]),
                     },
                 },
+                'loadtest': {
+                    'streams': OptionDef(required=True, default_value=4, allowed_types=[int]),
+                    'lines_per_second': OptionDef(required=True, default_value=400, allowed_types=[int]),
+                    'line_size': OptionDef(required=True, default_value=256, allowed_types=[int]),
+                    'query': OptionDef(allowed_types=[str]),
+                    'query_concurrency': OptionDef(required=True, default_value=2, allowed_types=[int]),
+                    'query_duration': OptionDef(required=True, default_value=300, allowed_types=[int]),
+                },
                 'authorization': {
                     'serviceaccount_create': OptionDef(required=True, default_value=True, allowed_types=[bool]),
                     'serviceaccount_use': OptionDef(allowed_types=[str]),
@@ -184,24 +422,38 @@ class LokiStackOptions(Options):
             },
             'enable': {
                 'grafana': OptionDef(required=True, default_value=True, allowed_types=[bool]),
+                'minio': OptionDef(required=True, default_value=False, allowed_types=[bool]),
+                'loadtest': OptionDef(required=True, default_value=False, allowed_types=[bool]),
             },
             'container': {
                 'promtail': OptionDef(required=True, default_value='grafana/promtail:2.0.0', allowed_types=[str]),
                 'loki': OptionDef(required=True, default_value='grafana/loki:2.0.0', allowed_types=[str]),
                 'grafana': OptionDef(required=True, default_value='grafana/grafana:7.2.0', allowed_types=[str]),
+                'minio': OptionDef(required=True, default_value='minio/minio:RELEASE.2020-10-28T08-16-50Z',
+                                   allowed_types=[str]),
+                'loadtest-generator': OptionDef(required=True, default_value='busybox:1.32.0', allowed_types=[str]),
+                'loadtest-query': OptionDef(required=True, default_value='curlimages/curl:7.73.0',
+                                            allowed_types=[str]),
             },
             'kubernetes': {
                 'volumes': {
-                    'loki-data': OptionDef(required=True, format=OptionDefFormat.KDATA_VOLUME,
+                    'loki-data': OptionDef(format=OptionDefFormat.KDATA_VOLUME,
                                       allowed_types=[Mapping, *KDataHelper_Volume.allowed_kdata()]),
                     'grafana-data': OptionDef(required=True, format=OptionDefFormat.KDATA_VOLUME,
                                               default_value={'emptyDir': {}},
                                               allowed_types=[Mapping, *KDataHelper_Volume.allowed_kdata()]),
+                    'minio-data': OptionDef(required=True, format=OptionDefFormat.KDATA_VOLUME,
+                                            default_value={'emptyDir': {}},
+                                            allowed_types=[Mapping, *KDataHelper_Volume.allowed_kdata()]),
+                },
+                'volumeclaimtemplates': {
+                    'loki-data': OptionDef(allowed_types=[Mapping]),
                 },
                 'resources': {
                     'promtail-daemonset': OptionDef(allowed_types=[Mapping]),
                     'loki-statefulset': OptionDef(allowed_types=[Mapping]),
                     'grafana-deployment': OptionDef(allowed_types=[Mapping]),
+                    'minio-statefulset': OptionDef(allowed_types=[Mapping]),
                 }
             },
         }
@@ -0,0 +1,55 @@
+import sys
+import weakref
+from typing import Any, Tuple, MutableMapping, MutableSequence
+
+_shared_str: MutableMapping[Tuple[type, int], str] = weakref.WeakValueDictionary()
+
+
+def share_str(value: str) -> str:
+    """
+    Returns a shared instance of a string equal to *value*, with the same type.
+
+    Plain strings use :func:`sys.intern`, :class:`kubragen.helper.HelperStr` subclasses (like the rendered
+    config files) are kept in a weak pool, so they are released when no object uses them anymore.
+
+    :param value: the string to share
+    :return: the shared instance, or *value* itself if it is the first one
+    """
+    if type(value) is str:
+        return sys.intern(value)
+    key = (type(value), hash(value))
+    try:
+        current = _shared_str.get(key)
+    except TypeError:
+        return value
+    if current is None:
+        try:
+            _shared_str[key] = value
+        except TypeError:
+            pass
+        return value
+    if current == value:
+        return current
+    return value
+
+
+def share_immutable(value: Any) -> Any:
+    """
+    Replaces, in place, the strings of a built object tree with shared instances, so identical text in
+    objects of different builds (like rendered config files, images and labels) is stored only once.
+
+    Only immutable values are shared. Dicts and lists are kept per object, as json patches and the
+    :class:`kubragen.builder.Builder` users change them in place.
+
+    :param value: the value to process
+    :return: the processed value, which is *value* itself for dicts and lists
+    """
+    if isinstance(value, str):
+        return share_str(value)
+    if isinstance(value, MutableMapping):
+        for k, v in value.items():
+            value[k] = share_immutable(v)
+    elif isinstance(value, MutableSequence):
+        for i, v in enumerate(value):
+            value[i] = share_immutable(v)
+    return value
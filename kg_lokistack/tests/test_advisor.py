@@ -0,0 +1,146 @@
+import unittest
+
+from kg_loki import LokiConfigFile, LokiConfigFileOptions
+from kg_promtail import PromtailConfigFile, PromtailConfigFileOptions
+from kubragen import KubraGen
+from kubragen.provider import Provider_Generic
+
+from kg_lokistack import LokiStackBuilder, LokiStackOptions, advise, LokiStackAdviceLevel
+
+
+class TestAdvisor(unittest.TestCase):
+    def setUp(self):
+        self.kg = KubraGen(provider=Provider_Generic())
+
+    def test_defaults(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+        advices = advise(lokistack_config)
+        options = [a.option for a in advices]
+        self.assertEqual(advices[0].level, LokiStackAdviceLevel.CRITICAL)
+        self.assertEqual(advices[0].option, 'kubernetes.volumes.loki-data')
+        self.assertIn('kubernetes.resources.loki-statefulset', options)
+        self.assertIn('kubernetes.volumes.grafana-data', options)
+        self.assertIn('config.loki.loki_config', options)
+
+    def test_tuned(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'config': {
+                'promtail': {
+                    'promtail_config': PromtailConfigFile(options=PromtailConfigFileOptions({
+                        'config': {
+                            'merge_config': {
+                                'client': {
+                                    'batchsize': 10240,
+                                },
+                            },
+                        },
+                    })),
+                },
+            },
+            'enable': {
+                'grafana': False,
+            },
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'persistentVolumeClaim': {
+                            'claimName': 'loki-claim',
+                        },
+                    }
+                },
+                'resources': {
+                    'loki-statefulset': {
+                        'limits': {
+                            'memory': '1Gi',
+                        },
+                    },
+                },
+            }
+        }))
+        advices = advise(lokistack_config, min_level=LokiStackAdviceLevel.WARNING)
+        self.assertEqual([a.option for a in advices], ['config.loki.loki_config', 'config.promtail.promtail_config'])
+
+    def test_empty_resources(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                },
+                'resources': {
+                    'loki-statefulset': {},
+                    'promtail-daemonset': {
+                        'requests': {
+                            'cpu': '100m',
+                        },
+                    },
+                },
+            }
+        }))
+        options = [a.option for a in advise(lokistack_config)]
+        self.assertIn('kubernetes.resources.loki-statefulset', options)
+        self.assertNotIn('kubernetes.resources.promtail-daemonset', options)
+
+    def test_emptydir_s3(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'config': {
+                'loki': {
+                    'storage': {
+                        'type': 's3',
+                        's3': {
+                            'schema_replace': True,
+                        },
+                    },
+                },
+            },
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+        advice = next(a for a in advise(lokistack_config) if a.option == 'kubernetes.volumes.loki-data')
+        self.assertEqual(advice.level, LokiStackAdviceLevel.INFO)
+
+    def test_results_cache(self):
+        def cache_advices(query_range):
+            lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+                'config': {
+                    'loki': {
+                        'loki_config': LokiConfigFile(options=LokiConfigFileOptions({
+                            'config': {
+                                'merge_config': {
+                                    'query_range': query_range,
+                                },
+                            },
+                        })),
+                    },
+                },
+                'kubernetes': {
+                    'volumes': {
+                        'loki-data': {
+                            'emptyDir': {},
+                        }
+                    }
+                }
+            }))
+            return [a for a in advise(lokistack_config) if 'query results cache' in a.message]
+
+        results_cache = {
+            'cache': {
+                'enable_fifocache': True,
+            },
+        }
+        self.assertEqual(len(cache_advices({'results_cache': results_cache})), 1)
+        self.assertEqual(len(cache_advices({'cache_results': True, 'results_cache': results_cache})), 0)
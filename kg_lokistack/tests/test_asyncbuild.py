@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List
+
+import yaml
+from kubragen import KubraGen
+from kubragen.exception import InvalidParamError
+from kubragen.output import OutputDriver, OutputFile, OutputProject, OutputFile_Kubernetes
+from kubragen.provider import Provider_Generic
+
+from kg_lokistack import LokiStackOptions, LokiStackAsyncBuilder
+
+
+class TestAsyncBuild(unittest.TestCase):
+    def setUp(self):
+        self.kg = KubraGen(provider=Provider_Generic())
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_build_concurrent(self):
+        asyncbuilder = LokiStackAsyncBuilder(max_concurrency=2)
+
+        async def render(basename: str) -> str:
+            lokistack_config = await asyncbuilder.create(self.kg, LokiStackOptions({
+                'basename': basename,
+                'kubernetes': {
+                    'volumes': {
+                        'loki-data': {
+                            'emptyDir': {},
+                        }
+                    }
+                }
+            }))
+            return await asyncbuilder.build_yaml(lokistack_config, lokistack_config.BUILD_SERVICE)
+
+        async def render_all():
+            return await asyncio.gather(*[render('stack{}'.format(i)) for i in range(5)])
+
+        results = self.loop.run_until_complete(render_all())
+        self.assertEqual(len(results), 5)
+        for i, result in enumerate(results):
+            names = [o['metadata']['name'] for o in yaml.safe_load_all(result)]
+            self.assertIn('stack{}-loki'.format(i), names)
+
+    def test_max_concurrency(self):
+        driver = _BlockingOutputDriver()
+        executor = ThreadPoolExecutor(max_workers=6)
+        asyncbuilder = LokiStackAsyncBuilder(max_concurrency=2, executor=executor)
+
+        projects = []
+        for i in range(6):
+            project = OutputProject(self.kg)
+            file = OutputFile_Kubernetes('stack{}.yaml'.format(i))
+            file.append([{'kind': 'ConfigMap', 'metadata': {'name': 'stack{}'.format(i)}}])
+            project.append(file)
+            projects.append(project)
+
+        async def output_all():
+            await asyncio.gather(*[asyncbuilder.output(project, driver) for project in projects])
+
+        try:
+            self.loop.run_until_complete(output_all())
+        finally:
+            executor.shutdown()
+
+        self.assertEqual(sorted(driver.filenames), ['001-stack{}.yaml'.format(i) for i in range(6)])
+        self.assertEqual(driver.max_active, 2)
+
+    def test_invalid_max_concurrency(self):
+        with self.assertRaises(InvalidParamError):
+            LokiStackAsyncBuilder(max_concurrency=0)
+
+
+class _BlockingOutputDriver(OutputDriver):
+    """Output driver that blocks for a while on each file, recording how many files are written at once."""
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.filenames: List[str] = []
+
+    def write_file(self, file: OutputFile, filename: str, filecontents: Any) -> None:
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.filenames.append(filename)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
@@ -1,7 +1,14 @@
+import base64
 import unittest
 
+import yaml
+
+from kg_grafana import GrafanaBuilder
 from kubragen import KubraGen
+from kubragen.exception import InvalidParamError
 from kubragen.jsonpatch import FilterJSONPatches_Apply, ObjectFilter, FilterJSONPatch
+from kubragen.kdata import KData_Secret
+from kubragen.object import Object
 from kubragen.provider import Provider_Generic
 
 from kg_lokistack import LokiStackBuilder, LokiStackOptions
@@ -45,3 +52,484 @@ class TestBuilder(unittest.TestCase):
                 {'op': 'check', 'path': '/metadata/namespace', 'cmp': 'equals', 'value': 'myns'},
             ]),
         ])
+
+    def test_replicas(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'namespace': 'myns',
+            'basename': 'mylokistack',
+            'config': {
+                'loki': {
+                    'replicas': 3,
+                    'storage': {
+                        'type': 's3',
+                        's3': {
+                            'endpoint': 's3.example.com',
+                            'schema_replace': True,
+                        },
+                    },
+                },
+            },
+            'kubernetes': {
+                'volumeclaimtemplates': {
+                    'loki-data': {
+                        'accessModes': ['ReadWriteOnce'],
+                        'resources': {
+                            'requests': {
+                                'storage': '10Gi',
+                            },
+                        },
+                    },
+                },
+            }
+        }))
+
+        FilterJSONPatches_Apply(items=lokistack_config.build(lokistack_config.BUILD_SERVICE), jsonpatches=[
+            FilterJSONPatch(filters=ObjectFilter(names=[lokistack_config.BUILDITEM_LOKI_STATEFULSET]), patches=[
+                {'op': 'check', 'path': '/spec/replicas', 'cmp': 'equals', 'value': 3},
+                {'op': 'check', 'path': '/spec/podManagementPolicy', 'cmp': 'equals', 'value': 'Parallel'},
+                {'op': 'check', 'path': '/spec/volumeClaimTemplates/0/metadata/name', 'cmp': 'equals',
+                 'value': 'storage'},
+                {'op': 'check', 'path': '/spec/volumeClaimTemplates/0/spec/resources/requests/storage',
+                 'cmp': 'equals', 'value': '10Gi'},
+                {'op': 'check', 'path': '/spec/template/spec/volumes', 'cmp': 'equals', 'value': [{
+                    'name': 'config',
+                    'secret': {
+                        'secretName': 'mylokistack-loki-config-secret',
+                        'items': [{
+                            'key': 'loki.yaml',
+                            'path': 'loki.yaml',
+                        }],
+                    },
+                }]},
+                {'op': 'check', 'path': '/spec/template/spec/containers/0/ports/1/name', 'cmp': 'equals',
+                 'value': 'memberlist'},
+            ]),
+            FilterJSONPatch(filters=ObjectFilter(names=[lokistack_config.BUILDITEM_LOKI_SERVICE_HEADLESS]), patches=[
+                {'op': 'check', 'path': '/spec/publishNotReadyAddresses', 'cmp': 'equals', 'value': True},
+                {'op': 'check', 'path': '/spec/ports/1/port', 'cmp': 'equals', 'value': 7946},
+            ]),
+        ])
+
+        loki_config = self._loki_config(lokistack_config)
+        self.assertEqual(loki_config['memberlist']['join_members'], ['mylokistack-loki-headless:7946'])
+        self.assertEqual(loki_config['ingester']['lifecycler']['ring']['kvstore']['store'], 'memberlist')
+        self.assertEqual(loki_config['ingester']['lifecycler']['ring']['replication_factor'], 3)
+
+    def test_replicas_two(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'config': {
+                'loki': {
+                    'replicas': 2,
+                    'storage': {
+                        'type': 's3',
+                        's3': {
+                            'schema_replace': True,
+                        },
+                    },
+                },
+            },
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+
+        loki_config = self._loki_config(lokistack_config)
+        self.assertEqual(loki_config['ingester']['lifecycler']['ring']['replication_factor'], 1)
+
+    def test_replicas_storage_invalid(self):
+        for storage, volumes in [
+            ({'type': 'filesystem'}, {'volumes': {'loki-data': {'emptyDir': {}}}}),
+            ({'type': 's3', 's3': {'schema_replace': True}}, {'volumes': {'loki-data': {'persistentVolumeClaim': {'claimName': 'loki-data'}}}}),
+        ]:
+            with self.assertRaises(InvalidParamError):
+                LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+                    'config': {
+                        'loki': {
+                            'replicas': 3,
+                            'storage': storage,
+                        },
+                    },
+                    'kubernetes': volumes,
+                }))
+
+    def _loki_config(self, lokistack_config: LokiStackBuilder):
+        secret = next(o for o in lokistack_config.build(lokistack_config.BUILD_CONFIG)
+                      if isinstance(o, Object) and o.name == lokistack_config.BUILDITEM_LOKI_CONFIG_SECRET)
+        return yaml.safe_load(base64.b64decode(secret['data']['loki.yaml']))
+
+    def test_promtail_node_scoped_discovery(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'config': {
+                'promtail': {
+                    'node_scoped_discovery': True,
+                },
+            },
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+
+        FilterJSONPatches_Apply(items=lokistack_config.build(lokistack_config.BUILD_SERVICE), jsonpatches=[
+            FilterJSONPatch(filters=ObjectFilter(names=[lokistack_config.BUILDITEM_PROMTAIL_DAEMONSET]), patches=[
+                {'op': 'check', 'path': '/spec/template/spec/initContainers/0/env/0/valueFrom/fieldRef/fieldPath',
+                 'cmp': 'equals', 'value': 'spec.nodeName'},
+                {'op': 'check', 'path': '/spec/template/spec/containers/0/args/0', 'cmp': 'equals',
+                 'value': '-config.file=/etc/promtail-node/promtail.yaml'},
+            ]),
+        ])
+
+        promtail_config = yaml.safe_load(lokistack_config.promtail_configfile_get())
+        for scrape_config in promtail_config['scrape_configs']:
+            self.assertEqual(scrape_config['kubernetes_sd_configs'][0]['selectors'], [{
+                'role': 'pod',
+                'field': 'spec.nodeName={}'.format(lokistack_config.PROMTAIL_NODE_NAME_PLACEHOLDER),
+            }])
+
+    def test_ruler(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'basename': 'mylokistack',
+            'config': {
+                'loki': {
+                    'ruler': {
+                        'enabled': True,
+                        'remote_write_url': 'http://prometheus:9090/api/v1/write',
+                        'rule_groups': [{
+                            'name': 'app',
+                            'rules': [{
+                                'record': 'app:log_lines:rate1m',
+                                'expr': 'sum by (app) (rate({namespace="app"}[1m]))',
+                            }],
+                        }],
+                    },
+                },
+            },
+            'container': {
+                'loki': 'grafana/loki:2.3.0',
+            },
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+
+        rules_config = next(o for o in lokistack_config.build(lokistack_config.BUILD_CONFIG)
+                            if o.name == lokistack_config.BUILDITEM_LOKI_RULES_CONFIG)
+        self.assertEqual(rules_config['metadata']['name'], 'mylokistack-loki-rules')
+        self.assertEqual(yaml.safe_load(rules_config['data']['rules.yaml'])['groups'][0]['rules'][0]['record'],
+                         'app:log_lines:rate1m')
+
+        FilterJSONPatches_Apply(items=lokistack_config.build(lokistack_config.BUILD_SERVICE), jsonpatches=[
+            FilterJSONPatch(filters=ObjectFilter(names=[lokistack_config.BUILDITEM_LOKI_STATEFULSET]), patches=[
+                {'op': 'check', 'path': '/spec/template/spec/containers/0/volumeMounts/2/mountPath',
+                 'cmp': 'equals', 'value': '/etc/loki-rules/fake'},
+                {'op': 'check', 'path': '/spec/template/spec/volumes/2/configMap/name',
+                 'cmp': 'equals', 'value': 'mylokistack-loki-rules'},
+            ]),
+        ])
+
+        loki_config = self._loki_config(lokistack_config)
+        self.assertEqual(loki_config['ruler']['storage']['local']['directory'], '/etc/loki-rules')
+        self.assertEqual(loki_config['ruler']['remote_write']['client']['url'], 'http://prometheus:9090/api/v1/write')
+
+    def test_ruler_remote_write_requires_loki_2_3(self):
+        for image in ['grafana/loki:2.0.0', 'registry.local:5000/grafana/loki:v2.2.1']:
+            with self.assertRaises(InvalidParamError):
+                LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+                    'config': {
+                        'loki': {
+                            'ruler': {
+                                'enabled': True,
+                                'remote_write_url': 'http://prometheus:9090/api/v1/write',
+                            },
+                        },
+                    },
+                    'container': {
+                        'loki': image,
+                    },
+                    'kubernetes': {
+                        'volumes': {
+                            'loki-data': {
+                                'emptyDir': {},
+                            }
+                        }
+                    }
+                }))
+
+    def test_ruler_recording_requires_remote_write(self):
+        with self.assertRaises(InvalidParamError):
+            LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+                'config': {
+                    'loki': {
+                        'ruler': {
+                            'enabled': True,
+                            'rule_groups': [{
+                                'name': 'app',
+                                'rules': [{
+                                    'record': 'app:log_lines:rate1m',
+                                    'expr': 'sum by (app) (rate({namespace="app"}[1m]))',
+                                }],
+                            }],
+                        },
+                    },
+                },
+                'kubernetes': {
+                    'volumes': {
+                        'loki-data': {
+                            'emptyDir': {},
+                        }
+                    }
+                }
+            }))
+
+    def test_storage_minio(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'basename': 'mylokistack',
+            'config': {
+                'loki': {
+                    'storage': {
+                        'type': 's3',
+                        's3': {
+                            'access_key_id': 'myaccesskey',
+                            'secret_access_key': KData_Secret('minio-credentials', 'secret_key'),
+                            'schema_replace': True,
+                        },
+                    },
+                },
+            },
+            'enable': {
+                'minio': True,
+            },
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+
+        FilterJSONPatches_Apply(items=lokistack_config.build(lokistack_config.BUILD_SERVICE), jsonpatches=[
+            FilterJSONPatch(filters=ObjectFilter(names=[lokistack_config.BUILDITEM_MINIO_STATEFULSET]), patches=[
+                {'op': 'check', 'path': '/spec/template/spec/containers/0/args/0', 'cmp': 'equals',
+                 'value': 'mkdir -p /data/loki && exec minio server /data'},
+                {'op': 'check', 'path': '/spec/template/spec/containers/0/env/1/valueFrom/secretKeyRef/name',
+                 'cmp': 'equals', 'value': 'minio-credentials'},
+            ]),
+            FilterJSONPatch(filters=ObjectFilter(names=[lokistack_config.BUILDITEM_LOKI_STATEFULSET]), patches=[
+                {'op': 'check', 'path': '/spec/template/spec/containers/0/env/0/name', 'cmp': 'equals',
+                 'value': 'AWS_ACCESS_KEY_ID'},
+                {'op': 'check', 'path': '/spec/template/spec/containers/0/env/1/valueFrom/secretKeyRef/key',
+                 'cmp': 'equals', 'value': 'secret_key'},
+            ]),
+        ])
+
+        loki_config = self._loki_config(lokistack_config)
+        self.assertNotIn('filesystem', loki_config['storage_config'])
+        self.assertEqual(loki_config['storage_config']['aws']['endpoint'], 'mylokistack-minio:9000')
+        self.assertEqual(loki_config['storage_config']['aws']['s3forcepathstyle'], True)
+        self.assertEqual(loki_config['storage_config']['boltdb_shipper']['shared_store'], 's3')
+        self.assertEqual(loki_config['schema_config']['configs'][0]['object_store'], 's3')
+
+    def test_storage_minio_requires_s3(self):
+        with self.assertRaises(InvalidParamError):
+            LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+                'enable': {
+                    'minio': True,
+                },
+                'kubernetes': {
+                    'volumes': {
+                        'loki-data': {
+                            'emptyDir': {},
+                        }
+                    }
+                }
+            }))
+
+    def test_storage_s3_schema_from(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'config': {
+                'loki': {
+                    'storage': {
+                        'type': 's3',
+                        's3': {
+                            'schema_from': '2021-06-01',
+                        },
+                    },
+                },
+            },
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+
+        loki_config = self._loki_config(lokistack_config)
+        schemas = loki_config['schema_config']['configs']
+        self.assertEqual(len(schemas), 2)
+        self.assertEqual(schemas[0]['object_store'], 'filesystem')
+        self.assertEqual(str(schemas[1]['from']), '2021-06-01')
+        self.assertEqual(schemas[1]['object_store'], 's3')
+        self.assertIn('filesystem', loki_config['storage_config'])
+        self.assertIn('aws', loki_config['storage_config'])
+
+    def test_storage_s3_schema_invalid(self):
+        for s3 in [{}, {'schema_from': '2021-06-01', 'schema_replace': True}, {'schema_from': 'tomorrow'}]:
+            with self.assertRaises(InvalidParamError):
+                LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+                    'config': {
+                        'loki': {
+                            'storage': {
+                                'type': 's3',
+                                's3': s3,
+                            },
+                        },
+                    },
+                    'kubernetes': {
+                        'volumes': {
+                            'loki-data': {
+                                'emptyDir': {},
+                            }
+                        }
+                    }
+                }))
+
+    def test_shared_between_stacks(self):
+        def build_config(basename: str):
+            lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+                'basename': basename,
+                'kubernetes': {
+                    'volumes': {
+                        'loki-data': {
+                            'emptyDir': {},
+                        }
+                    }
+                }
+            }))
+            return lokistack_config, next(o for o in lokistack_config.build(lokistack_config.BUILD_CONFIG)
+                                          if isinstance(o, Object) and
+                                          o.name == lokistack_config.BUILDITEM_PROMTAIL_CONFIG)
+
+        lokistack_config1, promtail_config1 = build_config('stack1')
+        lokistack_config2, promtail_config2 = build_config('stack2')
+        self.assertIs(lokistack_config1.options.defined_options, lokistack_config2.options.defined_options)
+        self.assertIs(promtail_config1['data']['promtail.yaml'], promtail_config2['data']['promtail.yaml'])
+        self.assertEqual(promtail_config1['metadata']['name'], 'stack1-promtail-config')
+
+        # built objects are still independent
+        promtail_config1['data']['promtail.yaml'] = 'changed'
+        self.assertNotEqual(promtail_config2['data']['promtail.yaml'], 'changed')
+
+    def _grafana_config(self, lokistack_config: LokiStackBuilder):
+        items = lokistack_config.build(lokistack_config.BUILD_CONFIG)
+        config = next(o for o in items if isinstance(o, Object) and
+                      o.name == 'grafana-{}'.format(GrafanaBuilder.BUILDITEM_CONFIG))
+        secret = next(o for o in items if isinstance(o, Object) and
+                      o.name == 'grafana-{}'.format(GrafanaBuilder.BUILDITEM_CONFIG_SECRET))
+        return config['data']['grafana.ini'], yaml.safe_load(base64.b64decode(secret['data']['datasources.yaml']))
+
+    def test_grafana_loki_datasource(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'basename': 'mylokistack',
+            'config': {
+                'grafana': {
+                    'loki_datasource': {
+                        'max_lines': 500,
+                        'keepalive': 45,
+                        'derived_fields': [{
+                            'name': 'TraceID',
+                            'matcherRegex': 'traceID=(\\w+)',
+                            'url': '$${__value.raw}',
+                            'datasourceUid': 'tempo',
+                        }],
+                    },
+                    'provisioning': {
+                        'datasources': [{
+                            'name': 'Prometheus',
+                            'type': 'prometheus',
+                            'url': 'http://prometheus:9090',
+                            'isDefault': True,
+                        }],
+                    },
+                },
+            },
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+
+        grafana_ini, datasources = self._grafana_config(lokistack_config)
+        self.assertIn('[dataproxy]\nkeep_alive_seconds = 45', grafana_ini)
+        self.assertEqual([d['name'] for d in datasources['datasources']], ['Prometheus', 'Loki'])
+        loki_datasource = datasources['datasources'][1]
+        self.assertEqual(loki_datasource['url'], 'http://mylokistack-loki:80')
+        self.assertEqual(loki_datasource['isDefault'], False)
+        self.assertEqual(loki_datasource['jsonData']['maxLines'], 500)
+        self.assertEqual(loki_datasource['jsonData']['timeout'], 60)
+        self.assertEqual(loki_datasource['jsonData']['derivedFields'][0]['name'], 'TraceID')
+
+    def test_grafana_loki_datasource_user(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'config': {
+                'grafana': {
+                    'grafana_config': '[log]\nmode = console\n',
+                    'provisioning': {
+                        'datasources': [{
+                            'name': 'Loki',
+                            'type': 'loki',
+                            'url': 'http://my-loki:3100',
+                        }],
+                    },
+                },
+            },
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+
+        grafana_ini, datasources = self._grafana_config(lokistack_config)
+        self.assertEqual(grafana_ini, '[log]\nmode = console\n')
+        self.assertEqual(datasources['datasources'], [{
+            'name': 'Loki',
+            'type': 'loki',
+            'url': 'http://my-loki:3100',
+        }])
+
+    def test_grafana_loki_datasource_default(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+
+        grafana_ini, datasources = self._grafana_config(lokistack_config)
+        self.assertNotIn('[dataproxy]', grafana_ini)
+        self.assertEqual(datasources['datasources'][0]['jsonData'], {
+            'maxLines': 1000,
+            'timeout': 60,
+        })
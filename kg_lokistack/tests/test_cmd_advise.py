@@ -0,0 +1,97 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from kg_lokistack.cmd.advise import main
+
+SCRIPT = '''
+from kubragen import KubraGen
+from kubragen.provider import Provider_Generic
+
+from kg_lokistack import LokiStackBuilder, LokiStackOptions
+
+print('script output')
+
+kg = KubraGen(provider=Provider_Generic())
+
+lokistack_config = LokiStackBuilder(kubragen=kg, options=LokiStackOptions({
+    'basename': 'mylokistack',
+    'kubernetes': {
+        'volumes': {
+            'loki-data': {
+                'emptyDir': {},
+            }
+        }
+    }
+}))
+
+lokistack_s3 = LokiStackBuilder(kubragen=kg, options=LokiStackOptions({
+    'basename': 'mylokistacks3',
+    'config': {
+        'loki': {
+            'storage': {
+                'type': 's3',
+                's3': {
+                    'schema_replace': True,
+                },
+            },
+        },
+    },
+    'kubernetes': {
+        'volumes': {
+            'loki-data': {
+                'emptyDir': {},
+            }
+        }
+    }
+}))
+
+if __name__ == '__main__':
+    raise Exception('output code must not run')
+'''
+
+
+class TestCmdAdvise(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.script = os.path.join(self.tempdir.name, 'lokistack.py')
+        with open(self.script, 'w') as f:
+            f.write(SCRIPT)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _main(self, *argv: str):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            ret = main(argv)
+        return ret, stdout.getvalue(), stderr.getvalue()
+
+    def test_fail_level(self):
+        ret, stdout, stderr = self._main('{}:lokistack_config'.format(self.script))
+        self.assertEqual(ret, 1)
+        self.assertTrue(stdout.startswith('mylokistack: '))
+        self.assertIn('[CRITICAL] kubernetes.volumes.loki-data', stdout)
+        self.assertNotIn('script output', stdout)
+        self.assertIn('script output', stderr)
+
+    def test_min_level(self):
+        ret, stdout, _ = self._main(self.script, '--min-level', 'critical', '--fail-level', 'critical')
+        self.assertEqual(ret, 1)
+        self.assertEqual(stdout.splitlines()[0], 'mylokistack: 1 advice(s)')
+
+    def test_min_level_above_fail_level(self):
+        ret, stdout, _ = self._main('{}:lokistack_s3'.format(self.script), '--min-level', 'critical',
+                                    '--fail-level', 'warning')
+        self.assertEqual(ret, 1)
+        self.assertEqual(stdout.splitlines(), ['mylokistacks3: 0 advice(s)'])
+
+    def test_variable_not_found(self):
+        with self.assertRaises(SystemExit):
+            self._main('{}:missing'.format(self.script))
+
+    def test_variable_not_builder(self):
+        with self.assertRaises(SystemExit):
+            self._main('{}:kg'.format(self.script))
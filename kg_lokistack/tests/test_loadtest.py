@@ -0,0 +1,85 @@
+import unittest
+
+from kubragen import KubraGen
+from kubragen.exception import InvalidParamError
+from kubragen.jsonpatch import FilterJSONPatches_Apply, ObjectFilter, FilterJSONPatch
+from kubragen.provider import Provider_Generic
+
+from kg_lokistack import LokiStackBuilder, LokiStackOptions
+from kg_lokistack.loadtest import loadtest_metrics_parse, LokiStackMetricsSample, loadtest_result
+
+
+class TestLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.kg = KubraGen(provider=Provider_Generic())
+
+    def test_disabled(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+        self.assertNotIn(lokistack_config.BUILD_LOADTEST, lokistack_config.build_names())
+        with self.assertRaises(InvalidParamError):
+            lokistack_config.internal_build_loadtest()
+
+    def test_build(self):
+        lokistack_config = LokiStackBuilder(kubragen=self.kg, options=LokiStackOptions({
+            'basename': 'mylokistack',
+            'config': {
+                'loadtest': {
+                    'streams': 10,
+                    'query_concurrency': 3,
+                },
+            },
+            'enable': {
+                'loadtest': True,
+            },
+            'kubernetes': {
+                'volumes': {
+                    'loki-data': {
+                        'emptyDir': {},
+                    }
+                }
+            }
+        }))
+        FilterJSONPatches_Apply(items=lokistack_config.build(lokistack_config.BUILD_LOADTEST), jsonpatches=[
+            FilterJSONPatch(filters=ObjectFilter(names=[lokistack_config.BUILDITEM_LOADTEST_GENERATOR]), patches=[
+                {'op': 'check', 'path': '/metadata/name', 'cmp': 'equals', 'value': 'mylokistack-loadtest-generator'},
+                {'op': 'check', 'path': '/spec/replicas', 'cmp': 'equals', 'value': 10},
+                {'op': 'check', 'path': '/spec/template/spec/containers/0/args/1', 'cmp': 'equals',
+                 'value': 'rate=40'},
+            ]),
+            FilterJSONPatch(filters=ObjectFilter(names=[lokistack_config.BUILDITEM_LOADTEST_QUERY]), patches=[
+                {'op': 'check', 'path': '/spec/parallelism', 'cmp': 'equals', 'value': 3},
+                {'op': 'check', 'path': '/spec/template/spec/containers/0/env/0/value', 'cmp': 'equals',
+                 'value': 'http://mylokistack-loki:80'},
+            ]),
+        ])
+
+    def test_result(self):
+        start = LokiStackMetricsSample(100, loadtest_metrics_parse('\n'.join([
+            '# TYPE loki_distributor_lines_received_total counter',
+            'loki_distributor_lines_received_total{tenant="fake"} 1000',
+            'loki_distributor_bytes_received_total{tenant="fake"} 50000',
+            'loki_request_duration_seconds_sum{method="POST",route="loki_api_v1_push",status_code="204"} 1',
+            'loki_request_duration_seconds_count{method="POST",route="loki_api_v1_push",status_code="204"} 10',
+            'promtail_sent_entries_total{host="loki:3100"} 900',
+        ])))
+        end = LokiStackMetricsSample(110, loadtest_metrics_parse('\n'.join([
+            'loki_distributor_lines_received_total{tenant="fake"} 3000',
+            'loki_distributor_bytes_received_total{tenant="fake"} 150000',
+            'loki_request_duration_seconds_sum{method="POST",route="loki_api_v1_push",status_code="204"} 3',
+            'loki_request_duration_seconds_count{method="POST",route="loki_api_v1_push",status_code="204"} 30',
+            'promtail_sent_entries_total{host="loki:3100"} 2900',
+        ])))
+        result = loadtest_result(start, end)
+        self.assertEqual(result.lines_per_second, 200)
+        self.assertEqual(result.bytes_per_second, 10000)
+        self.assertEqual(result.promtail_entries_per_second, 200)
+        self.assertAlmostEqual(result.push_latency, 0.1)
+        self.assertIsNone(result.query_latency)